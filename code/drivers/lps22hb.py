@@ -32,15 +32,56 @@ LPS_TEMP_OUT_L        =  b"\x2B"  # Temperature output registers
 LPS_TEMP_OUT_H        =  b"\x2C"
 LPS_RES               =  b"\x33"  # Filter reset register
 
+# CTRL_REG1 bits
+LPS_CTRL1_BDU         =  0x02
+LPS_ODR_CODES         =  {0: 0, 1: 1, 10: 2, 25: 3, 50: 4, 75: 5}  # Hz -> ODR[2:0], 0为单次模式
+
+# CTRL_REG2 bits
+LPS_CTRL2_FIFO_EN     =  0x40
+LPS_CTRL2_IF_ADD_INC  =  0x10  # 多字节读写时寄存器地址自动递增
+LPS_CTRL2_ONE_SHOT    =  0x01
+
+# CTRL_REG3 bits
+LPS_CTRL3_F_FTH       =  0x10  # INT_DRDY 引脚输出FIFO水位中断 (0x20 是 F_FSS5, FIFO满)
+
+# FIFO_CTRL / FIFO_STATUS
+LPS_FIFO_BYPASS       =  0x00
+LPS_FIFO_STREAM       =  0x40
+LPS_FIFO_SIZE         =  32
+LPS_FIFO_STATUS_FTH   =  0x80
+LPS_FIFO_STATUS_OVR   =  0x40
+LPS_FIFO_STATUS_FSS   =  0x3F
+LPS_SAMPLE_SIZE       =  5  # PRESS_OUT_XL..TEMP_OUT_H
+
+# STATUS bits
+LPS_STATUS_P_DA       =  0x01
+LPS_STATUS_T_DA       =  0x02
+
+LPS_ONESHOT_MS        =  15   # 单次转换约13ms, 之后才开始查询状态
+LPS_POLL_MS           =  2
+LPS_TIMEOUT_MS        =  100
+
 
 class Lps22hb(I2CIOWrapper):
 
+    def __init__(self, i2c, slaveaddr):
+        super().__init__(i2c, slaveaddr)
+        # STATUS 与 PRESS_OUT_XL..TEMP_OUT_H 地址连续, 一次读出
+        self.__output = bytearray(6)
+        self.__ctrl_reg2 = LPS_CTRL2_IF_ADD_INC
+        self.__fifo = None  # 连续模式下一次读出watermark个样本的缓冲区
+        self.streaming = False
+        self.overrun = False  # 上次读FIFO前是否已溢出(有样本丢失)
+        self.last = (0, 0)  # 最近一个样本 (press, temp)
+
     def init(self):
         chip_id = self.getChipId()
         if chip_id != LPS22HB_CHIP_ID:
             raise ValueError("{} got Wrong chip id: 0x{:02X}".format(type(self).__name__, chip_id))
         self.reset()  # Wait for reset to complete
         self.write(LPS_CTRL_REG1, b"\x02")  # Low-pass filter disabled , output registers not updated until MSB and LSB have been read , Enable Block Data Update , Set Output Data Rate to 0 
+        self.__ctrl_reg2 = self.read(LPS_CTRL_REG2)[0] | LPS_CTRL2_IF_ADD_INC
+        self.write(LPS_CTRL_REG2, bytes([self.__ctrl_reg2]))
 
     def getChipId(self):
         return self.read(LPS_WHO_AM_I)[0]
@@ -54,27 +95,90 @@ class Lps22hb(I2CIOWrapper):
             data &= 0x04
 
     def __startOneshot(self):
-        data = self.read(LPS_CTRL_REG3)[0]
-        data = self.read(LPS_CTRL_REG2)[0]
-        data |= 0x01  # ONE_SHOT Set 1
-        self.write(LPS_CTRL_REG2, bytes([data]))
+        # CTRL_REG2 由驱动维护, 不必先读
+        self.write(LPS_CTRL_REG2, bytes([self.__ctrl_reg2 | LPS_CTRL2_ONE_SHOT]))
+
+    def startStream(self, odr=1, watermark=16):
+        """连续测量, 样本进入FIFO(stream模式), 达到watermark个样本后由readFifo一次读出
+
+        :param odr: 输出数据率Hz, 1/10/25/50/75
+        :param watermark: 1~31, 同时通过 INT_DRDY 引脚输出水位中断
+        """
+        if not odr or odr not in LPS_ODR_CODES:
+            raise ValueError("unsupported odr: {}".format(odr))
+        if not 0 < watermark < LPS_FIFO_SIZE:
+            raise ValueError("watermark should be 1~{}".format(LPS_FIFO_SIZE - 1))
+        self.__fifo = bytearray(watermark * LPS_SAMPLE_SIZE)
+        self.write(LPS_FIFO_CTRL, bytes([LPS_FIFO_BYPASS]))  # 先切到bypass清空FIFO
+        self.__ctrl_reg2 |= LPS_CTRL2_FIFO_EN
+        self.write(LPS_CTRL_REG2, bytes([self.__ctrl_reg2]))
+        self.write(LPS_CTRL_REG3, bytes([LPS_CTRL3_F_FTH]))
+        self.write(LPS_FIFO_CTRL, bytes([LPS_FIFO_STREAM | watermark]))
+        self.write(LPS_CTRL_REG1, bytes([LPS_ODR_CODES[odr] << 4 | LPS_CTRL1_BDU]))
+        self.streaming = True
+
+    def stopStream(self):
+        self.write(LPS_CTRL_REG1, bytes([LPS_CTRL1_BDU]))  # ODR 0, 回到单次模式
+        self.write(LPS_FIFO_CTRL, bytes([LPS_FIFO_BYPASS]))
+        self.__ctrl_reg2 &= ~LPS_CTRL2_FIFO_EN
+        self.write(LPS_CTRL_REG2, bytes([self.__ctrl_reg2]))
+        self.write(LPS_CTRL_REG3, b"\x00")
+        self.__fifo = None
+        self.streaming = False
+
+    def fifoStatus(self):
+        """:return: (样本数, 是否达到水位)"""
+        status = self.read(LPS_FIFO_STATUS)[0]
+        self.overrun = bool(status & LPS_FIFO_STATUS_OVR)
+        return status & LPS_FIFO_STATUS_FSS, bool(status & LPS_FIFO_STATUS_FTH)
+
+    def readFifo(self):
+        """读出FIFO中的样本 [(press, temp), ...], 从旧到新
+
+        每次突发读取watermark个样本(FIFO模式下输出寄存器地址在0x2C后回绕到0x28),
+        不足watermark的样本留到下一次.
+        """
+        if not self.streaming:
+            return []
+        level, _ = self.fifoStatus()
+        fifo = self.__fifo
+        size = len(fifo)
+        samples = []
+        while level * LPS_SAMPLE_SIZE >= size:
+            self.readInto(LPS_PRESS_OUT_XL, fifo)
+            for index in range(0, size, LPS_SAMPLE_SIZE):
+                samples.append(self.__decode(fifo, index))
+            level -= size // LPS_SAMPLE_SIZE
+        if samples:
+            self.last = samples[-1]
+        return samples
+
+    @staticmethod
+    def __decode(buf, index):
+        # PRESS_OUT_XL, L, H, TEMP_OUT_L, H
+        press_data = (buf[index + 2] << 16 | buf[index + 1] << 8 | buf[index]) / 4096.0
+        temp_data = buf[index + 4] << 8 | buf[index + 3]
+        if temp_data & 0x8000:
+            temp_data -= 0x10000  # 温度为有符号数
+        return round(press_data, 2), round(temp_data / 100.0, 2)
+
+    def __readOutput(self):
+        output = self.readInto(LPS_STATUS, self.__output)
+        return output[0] & (LPS_STATUS_P_DA | LPS_STATUS_T_DA) == (LPS_STATUS_P_DA | LPS_STATUS_T_DA)
 
     def getTempAndPressure(self):
+        if self.streaming:
+            # 连续模式下不能触发单次测量, 返回最近读出的样本
+            return self.last
         self.__startOneshot()
-        for _ in range(10):
-            status = self.read(LPS_STATUS)[0]
-            if not (status & 0x01 and status & 0x02):
-                continue
-            press_out_xl = self.read(LPS_PRESS_OUT_XL)[0]
-            press_out_l = self.read(LPS_PRESS_OUT_L)[0]
-            press_out_h = self.read(LPS_PRESS_OUT_H)[0]
-            press_data = ((press_out_h << 16) + (press_out_l << 8) + press_out_xl) / 4096.0
-            temp_out_l = self.read(LPS_TEMP_OUT_L)[0]
-            temp_out_h = self.read(LPS_TEMP_OUT_H)[0]
-            temp_data =((temp_out_h << 8) + temp_out_l) / 100.0
-            return round(press_data, 2), round(temp_data, 2)
-        else:
-            return 0, 0
+        utime.sleep_ms(LPS_ONESHOT_MS)
+        deadline = utime.ticks_add(utime.ticks_ms(), LPS_TIMEOUT_MS)
+        while not self.__readOutput():
+            if utime.ticks_diff(deadline, utime.ticks_ms()) <= 0:
+                return 0, 0
+            utime.sleep_ms(LPS_POLL_MS)
+        self.last = self.__decode(self.__output, 1)
+        return self.last
         
 
 if __name__ == '__main__':
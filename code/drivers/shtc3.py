@@ -5,6 +5,7 @@ The SHTC3 is a digital humidity and temperature sensor designed especially for b
 
 import utime
 from usr.libs.i2c import I2CIOWrapper
+from usr.libs.sensirion import crc8, check_frame
 
 
 SHTC3_SLAVE_ADDR = 0x70
@@ -23,9 +24,16 @@ SHTC3_LM_CD_READ_RH     =	b"\x40\x1A"
 SHTC3_SOFTWARE_RESET    =	b"\x40\x1A"
 SHTC3_ID                = 	b"\xEF\xC8"
 
+# 单次测量耗时(ms), 按手册最大值: 正常模式12.1ms, 低功耗模式0.8ms
+SHTC3_NM_MEASURE_MS     =   13
+SHTC3_LM_MEASURE_MS     =   1
+
 
 class Shtc3(I2CIOWrapper):
 
+    low_power = False  # 低功耗模式测量更快, 噪声略大
+    crc_error = -1  # 上一次测量CRC校验失败的字: 0 温度, 1 湿度, -1 无错误
+
     def init(self):
         chip_id = self.getChipId()
         if chip_id != 0x0807:
@@ -38,7 +46,7 @@ class Shtc3(I2CIOWrapper):
 
     def wakeup(self):
         self.write(SHTC3_WAKEUP, b'')
-        utime.sleep_ms(30)
+        utime.sleep_ms(1)  # 唤醒最长240us
 
     def sleep(self):
         self.write(SHTC3_SLEEP, b'')
@@ -49,20 +57,12 @@ class Shtc3(I2CIOWrapper):
 
     @staticmethod
     def checkCrc(data, checksum):
-        crc = 0xFF
-        for one in data:
-            crc ^= one
-            for _ in range(8):
-                if(crc & 0x80):
-                    crc = (crc << 1) ^ 0x131
-                else:
-                    crc = crc << 1
-        return crc == checksum
+        return crc8(data) == checksum
 
     def __getValue(self):
         utime.sleep_ms(20)
         data = self.read(b'', 3)
-        if self.checkCrc(data[:2], data[2]):
+        if check_frame(data) == -1:
             return data[0] << 8 | data[1]
 
     def getTempValue(self):
@@ -83,12 +83,36 @@ class Shtc3(I2CIOWrapper):
             return round(value, 2)
         return 0
     
+    def setLowPower(self, flag=True):
+        self.low_power = bool(flag)
+
+    def measure(self):
+        """One measurement returning both raw words (temp, humi), None on CRC error.
+
+        The T-first command answers with a 6 byte frame: temp(2) crc humi(2) crc.
+        """
+        if self.low_power:
+            self.write(b'', SHTC3_LM_CD_READ_TH)
+            utime.sleep_ms(SHTC3_LM_MEASURE_MS)
+        else:
+            self.write(b'', SHTC3_NM_CD_READ_TH)
+            utime.sleep_ms(SHTC3_NM_MEASURE_MS)
+        data = self.read(b'', 6)
+        self.crc_error = check_frame(data)
+        if self.crc_error == -1:
+            return data[0] << 8 | data[1], data[3] << 8 | data[4]
+
     def getTempAndHumi(self):
         self.wakeup()
-        temp = self.getTempValue()
-        humi = self.getHumiValue()
-        self.sleep()
-        return temp, humi
+        try:
+            value = self.measure()
+        finally:
+            self.sleep()
+        if value is None:
+            return 0, 0
+        temp = 175 * value[0] / 65536.0 - 45.0
+        humi = 100 * value[1] / 65536.0
+        return round(temp, 2), round(humi, 2)
 
 
 if __name__ == "__main__":
@@ -96,8 +120,6 @@ if __name__ == "__main__":
     shtc3_dev = Shtc3(I2C(I2C.I2C1, I2C.STANDARD_MODE), SHTC3_SLAVE_ADDR)
     shtc3_dev.init()
     for i in range(100):
-        shtc3_dev.wakeup()
-        temp = shtc3_dev.getTempValue()
-        humi = shtc3_dev.getHumiValue()
-        shtc3_dev.sleep()
+        shtc3_dev.setLowPower(i % 2)
+        temp, humi = shtc3_dev.getTempAndHumi()
         print("Temperature: {:.2f}°C , Humidity: {:.2f} %\n".format(temp, humi))
@@ -17,6 +17,7 @@ class Tcs34725(I2CIOWrapper):
 
     Gain_t = 0
     IntegrationTime_t = 0
+    interrupt_enabled = False
 
     TCS34725_CMD_BIT        = 0x80
     TCS34725_CMD_ReadByte  = 0x00
@@ -83,17 +84,39 @@ class Tcs34725(I2CIOWrapper):
     TCS34725_GAIN_4X                = 0x01   #<  4x gain  */
     TCS34725_GAIN_16X               = 0x02   #<  16x gain */
     TCS34725_GAIN_60X               = 0x03   #<  60x gain */
+    GAIN_VALUES                     = (1, 4, 16, 60)  # 按增益寄存器值索引
+
+    # AGC: 积分周期数(每周期2.4ms)候选, 由短到长; 不含700ms以免读数延迟过大
+    AGC_CYCLES          = (1, 10, 20, 42, 64)
+    AGC_MIN_COUNT       = 1000   # clear计数低于该值时分辨率不足
+    AGC_HIGH            = 0.8    # clear计数不超过满量程的该比例
+    AGC_SATURATION      = 0.9    # 超过满量程的该比例视为饱和, 实际光照可能更强
     
 
     def __init__(self, i2c, slaveaddr=0x29, debug=False):
         super().__init__(i2c, slaveaddr)
         self.debug = debug
+        # STATUS 与 CDATAL..BDATAH 地址连续, 自动递增一次读出
+        self.__status_reg = bytes([self.TCS34725_CMD_BIT | self.TCS34725_CMD_Read_Word | self.TCS34725_STATUS])
+        self.__data = bytearray(9)
+        self.C = self.R = self.G = self.B = 0
+        self.agc = False  # 根据clear计数自动调整增益和积分时间
+        # 当前C/R/G/B测量时的增益和ATIME, AGC调整后仍按它们换算lux
+        self.__sample_gain = 0
+        self.__sample_atime = 0
         #Set GPIO mode
-        self.INT = ExtInt(ExtInt.GPIO29, ExtInt.IRQ_FALLING, ExtInt.PULL_PU, lambda args: print(args))
+        self.callback = None  # INT引脚拉低(clear通道超出门限)时调用
+        self.INT = ExtInt(ExtInt.GPIO29, ExtInt.IRQ_FALLING, ExtInt.PULL_PU, self.__onInterrupt)
         self.INT.enable()
         if (self.debug):
           print("Reseting TSL2581")
 
+    def __onInterrupt(self, args):
+        if self.callback is not None:
+            self.callback(args)
+        elif self.debug:
+            print(args)
+
     def writeByte(self, reg, value):
         # "Writes an 8-bit value to the specified register/address"
         reg = reg | self.TCS34725_CMD_BIT  # Register addressing highest bit is set to 1
@@ -140,10 +163,12 @@ class Tcs34725(I2CIOWrapper):
     def interruptEnable(self):
         reg = self.readByte(self.TCS34725_ENABLE)
         self.writeByte(self.TCS34725_ENABLE, reg | self.TCS34725_ENABLE_AIEN)
+        self.interrupt_enabled = True
 
     def interruptDisable(self):
         reg = self.readByte(self.TCS34725_ENABLE)
         self.writeByte(self.TCS34725_ENABLE, reg & (~self.TCS34725_ENABLE_AIEN))
+        self.interrupt_enabled = False
 
     def Set_Interrupt_Persistence_Reg(self, PER):
         if(PER < 0x10):
@@ -152,10 +177,21 @@ class Tcs34725(I2CIOWrapper):
             self.writeByte(self.TCS34725_PERS, self.TCS34725_PERS_60_CYCLE)
 
     def setInterruptThreshold(self, Threshold_H,  Threshold_L):
-        self.writeByte(self.TCS34725_AILTL, Threshold_L & 0xff)
-        self.writeByte(self.TCS34725_AILTH, Threshold_L >> 8)
-        self.writeByte(self.TCS34725_AIHTL, Threshold_H & 0xff)
-        self.writeByte(self.TCS34725_AIHTH, Threshold_H >> 8)
+        # AILTL..AIHTH 地址连续, 自动递增一次写入
+        reg = self.TCS34725_CMD_BIT | self.TCS34725_CMD_Read_Word | self.TCS34725_AILTL
+        self.write(bytes([reg]), bytes([Threshold_L & 0xff, Threshold_L >> 8, Threshold_H & 0xff, Threshold_H >> 8]))
+
+    def armInterrupt(self, clear, ratio=0.2, persistence=TCS34725_PERS_5_CYCLE):
+        """Interrupt once the clear channel leaves clear +- ratio for `persistence` cycles.
+
+        Call again with the new clear count after each interrupt to re-arm.
+        """
+        delta = max(int(clear * ratio), 1)
+        self.setInterruptThreshold(min(clear + delta, 0xFFFF), max(clear - delta, 0))
+        self.Set_Interrupt_Persistence_Reg(persistence)
+        self.clearInterruptFlag()
+        if not self.interrupt_enabled:
+            self.interruptEnable()
 
     def clearInterruptFlag(self):
         self.writeByte(self.TCS34725_CMD_Clear_INT, 0x00)
@@ -168,8 +204,10 @@ class Tcs34725(I2CIOWrapper):
         self.setGain(self.TCS34725_GAIN_60X)
         self.IntegrationTime_t = self.TCS34725_INTEGRATIONTIME_154MS
         self.Gain_t = self.TCS34725_GAIN_60X
+        self.__sample_gain = self.Gain_t
+        self.__sample_atime = self.IntegrationTime_t
         self.enable()
-        self.interruptEnable()
+        # 中断由 armInterrupt 按当前光照设置门限后再开启
 
 
     def getLuxInterrupt(self, Threshold_H, Threshold_L):
@@ -184,23 +222,89 @@ class Tcs34725(I2CIOWrapper):
     def getChipId(self):
         return self.readByte(self.TCS34725_ID)
 
+    def getIntegrationTimeMs(self):
+        return (256 - self.IntegrationTime_t) * 2.4
+
     def getRGBData(self):
-        self.C = self.readWord(self.TCS34725_CDATAL | self.TCS34725_CMD_Read_Word)
-        self.R = self.readWord(self.TCS34725_RDATAL | self.TCS34725_CMD_Read_Word)
-        self.G = self.readWord(self.TCS34725_GDATAL | self.TCS34725_CMD_Read_Word)
-        self.B = self.readWord(self.TCS34725_BDATAL | self.TCS34725_CMD_Read_Word)
-        if(self.IntegrationTime_t == self.TCS34725_INTEGRATIONTIME_2_4MS):
-            time.sleep(0.01)
-        elif(self.IntegrationTime_t == self.TCS34725_INTEGRATIONTIME_24MS):
-            time.sleep(0.04)
-        elif(self.IntegrationTime_t == self.TCS34725_INTEGRATIONTIME_50MS):
-            time.sleep(0.05)
-        elif(self.IntegrationTime_t == self.TCS34725_INTEGRATIONTIME_101MS):
-            time.sleep(0.1)
-        elif(self.IntegrationTime_t == self.TCS34725_INTEGRATIONTIME_154MS):
-            time.sleep(0.2)
-        elif(self.IntegrationTime_t == self.TCS34725_INTEGRATIONTIME_700MS):
-            time.sleep(0.7)  
+        """Read STATUS and the C/R/G/B words in one transaction.
+
+        Conversion runs continuously once enabled, so the latest result is
+        normally valid at once; only before the first integration completes
+        (AVALID clear) we wait one integration time and read again.
+        Returns False if no valid result arrived, keeping the previous C/R/G/B.
+        """
+        data = self.__data
+        for _ in range(3):
+            self.readInto(self.__status_reg, data)
+            if data[0] & self.TCS34725_STATUS_AVALID:
+                break
+            time.sleep_ms(int(self.getIntegrationTimeMs()) + 1)
+        else:
+            return False
+        # 数据寄存器低字节在前
+        self.C = data[2] << 8 | data[1]
+        self.R = data[4] << 8 | data[3]
+        self.G = data[6] << 8 | data[5]
+        self.B = data[8] << 8 | data[7]
+        self.__sample_gain = self.Gain_t
+        self.__sample_atime = self.IntegrationTime_t
+        if self.agc:
+            self.autoGain()
+        return True
+
+    @staticmethod
+    def __maxCount(cycles):
+        return min(1024 * cycles, 0xFFFF)
+
+    def __pickSetting(self, rate, cycles_now, in_range):
+        # 积分时间尽量短, 同一积分时间下增益尽量高, 预计clear计数落在 [AGC_MIN_COUNT, AGC_HIGH * 满量程]
+        for cycles in self.AGC_CYCLES:
+            limit = self.__maxCount(cycles) * self.AGC_HIGH
+            # 当前读数正常时, 更短的积分时间需要留出余量才切换, 避免来回跳
+            floor = self.AGC_MIN_COUNT * (1.5 if in_range and cycles < cycles_now else 1)
+            for gain in (self.TCS34725_GAIN_60X, self.TCS34725_GAIN_16X, self.TCS34725_GAIN_4X, self.TCS34725_GAIN_1X):
+                expected = rate * self.GAIN_VALUES[gain] * cycles
+                if expected <= limit:
+                    if expected >= floor:
+                        return gain, cycles
+                    break
+        if in_range:
+            return None
+        if rate * self.AGC_CYCLES[0] > self.__maxCount(self.AGC_CYCLES[0]) * self.AGC_HIGH:
+            return self.TCS34725_GAIN_1X, self.AGC_CYCLES[0]  # 最小设置仍过亮
+        return self.TCS34725_GAIN_60X, self.AGC_CYCLES[-1]  # 最大设置仍过暗
+
+    def autoGain(self):
+        """Pick gain/ATIME from the last clear count; returns True if changed.
+
+        A change restarts the ADC so the next getRGBData waits for a full
+        integration with the new setting.
+        """
+        cycles_now = 256 - self.__sample_atime
+        max_count = self.__maxCount(cycles_now)
+        in_range = self.AGC_MIN_COUNT <= self.C <= max_count * self.AGC_HIGH
+        rate = max(self.C, 1) / (self.GAIN_VALUES[self.__sample_gain] * cycles_now)
+        if self.C >= max_count * self.AGC_SATURATION:
+            rate *= 4
+        setting = self.__pickSetting(rate, cycles_now, in_range)
+        if setting is None:
+            return False
+        gain, cycles = setting
+        if gain == self.Gain_t and 256 - cycles == self.IntegrationTime_t:
+            return False
+        self.setGain(gain)
+        self.setIntegrationTime(256 - cycles)
+        # 关闭再打开ADC, 丢弃按旧设置进行中的积分, AVALID随之清零
+        enable = self.TCS34725_ENABLE_PON | (self.TCS34725_ENABLE_AIEN if self.interrupt_enabled else 0)
+        self.writeByte(self.TCS34725_ENABLE, enable)
+        self.writeByte(self.TCS34725_ENABLE, enable | self.TCS34725_ENABLE_AEN)
+        return True
+
+    def expectedClear(self):
+        """The last clear count scaled to the current gain/ATIME, e.g. for re-arming thresholds."""
+        scale = (self.GAIN_VALUES[self.Gain_t] * (256 - self.IntegrationTime_t)) / \
+            (self.GAIN_VALUES[self.__sample_gain] * (256 - self.__sample_atime))
+        return min(int(self.C * scale), 0xFFFF)
 
     #Convert read data to RGB888 format
     def getRGB888(self):
@@ -262,7 +366,8 @@ class Tcs34725(I2CIOWrapper):
         self.RG565 = (((RGB565_R>>3) << 11) | ((RGB565_G>>2) << 5) | (RGB565_B>>3 ))&0xffff
 
     def getLux(self):
-        atime_ms = ((256 - self.IntegrationTime_t) * 2.4)
+        # 按测量时的设置换算, AGC之后也正确
+        atime_ms = ((256 - self.__sample_atime) * 2.4)
         if(self.R + self.G + self.B > self.C):
             ir =  (self.R + self.G + self.B - self.C) / 2 
         else:
@@ -270,15 +375,7 @@ class Tcs34725(I2CIOWrapper):
         r_comp = self.R - ir
         g_comp = self.G - ir
         b_comp = self.B - ir
-        Gain_temp = 1
-        if(self.Gain_t == self.TCS34725_GAIN_1X):
-            Gain_temp = 1
-        elif(self.Gain_t == self.TCS34725_GAIN_4X):
-            Gain_temp = 4
-        elif(self.Gain_t == self.TCS34725_GAIN_16X):
-            Gain_temp = 16
-        elif(self.Gain_t == self.TCS34725_GAIN_60X):
-            Gain_temp = 60
+        Gain_temp = self.GAIN_VALUES[self.__sample_gain]
  
         cpl = (atime_ms * Gain_temp) / (TCS34725_GA * TCS34725_DF)
         lux = (TCS34725_R_Coef * (float)(r_comp) + TCS34725_G_Coef * \
@@ -297,7 +394,9 @@ class Tcs34725(I2CIOWrapper):
         return cct
 
     def getRGBValue(self):
-        self.getRGBData()
+        # 没有新的有效结果时不能把上一次的读数当作本次返回
+        if not self.getRGBData():
+            raise self.I2CReadError("{} no valid RGBC result, AVALID not set".format(type(self).__name__))
         self.getRGB888()
         return self.RGB888
 
@@ -306,6 +405,7 @@ if __name__ == "__main__":
     from machine import I2C
     tcs34725 = Tcs34725(I2C(I2C.I2C1, I2C.STANDARD_MODE), TCS34725_SLAVE_ADDR)
     tcs34725.init()
+    tcs34725.interruptEnable()
     
     time.sleep(2)
     for _ in range(20):
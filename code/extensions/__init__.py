@@ -1,10 +1,12 @@
 from .qth_client import QthClient
-# from .gnss_service import GnssService
+from .gnss_service import GnssService
 from .lbs_service import LbsService
+from .location_service import LocationService
 from .sensor_service import SensorService
 
 
 qth_client = QthClient()
-# gnss_service = GnssService()
+gnss_service = GnssService()
 lbs_service = LbsService()
+location_service = LocationService()
 sensor_service = SensorService()
@@ -3,101 +3,411 @@ import quecgnss
 from usr.libs import CurrentApp
 from usr.libs.threading import Thread
 from usr.libs.logging import getLogger
+from usr.libs.geo import DistanceEngine
+from usr.libs.kalman import PositionFilter
+from usr.libs.track import TrackBuffer
+from usr.libs.trackcodec import encode_track
+from usr.libs.geofence import GeofenceEngine
+from usr.libs.odometer import Odometer
+from usr.libs.nmea import COORD_SCALE, checksum, parse_hex2, field_span, parse_coord, parse_timestamp
 import _thread
 from .import qth_client
-try:
-    from math import sin, asin, cos, radians, fabs, sqrt
-except:
-    from cmath import sin as csin, cos as ccos, pi
-
-    def radians(x):
-        return x * pi / 180.0
-    
-    def fabs(x):
-        return x if x > 0 else -x
-
-    def sin(x):
-        return csin(x).real
-    
-    def cos(x):
-        return ccos(x).real
-    
-    def asin(x):
-        low, high = -1, 1
-        while abs(high - low) > 1e-10:  # 精度控制
-            mid = (low + high) / 2.0
-            if sin(mid) < x:
-                low = mid
-            else:
-                high = mid
-        return (low + high) / 2.0
-
 
 logger = getLogger(__name__)
 
 
-EARTH_RADIUS = 6371  # 地球平均半径大约6371km
 GLOBAL_DISTANCE = 0  # 里程km
+TSL_ID_GEOFENCE = 8  # 围栏事件: {1: 围栏id, 2: 1进入/0离开}
+GEOFENCE_PENDING_MAX = 32  # 未上报成功的围栏事件最多缓存条数, 超出丢弃最早的
+TSL_ID_ODOMETER = 9  # 总里程km
+TSL_ID_TRIP = 10  # 本次行程里程km
+ODOMETER_REPORT_STEP = 1  # km, 里程变化超过该值才上报
+MOVE_THRESHOLD = 0.05  # km, 位移超过该值才上报
+NMEA_SENTENCES = ('$GNRMC', '$GNGGA', '$GNGSA')  # 默认只解析定位用到的语句, 可由配置 GNSS_NMEA_SENTENCES 覆盖
 
 
-def hav(theta):
-    s = sin(theta / 2)
-    return s * s
-
-
-def gps_distance(lat0, lng0, lat1, lng1):
-    # 用haversine公式计算球面两点间的距离
-    # 经纬度转换成弧度
-    lat0 = radians(lat0)
-    lat1 = radians(lat1)
-    lng0 = radians(lng0)
-    lng1 = radians(lng1)
-    dlng = fabs(lng0 - lng1)
-    dlat = fabs(lat0 - lat1)
-    h = hav(dlat) + cos(lat0) * cos(lat1) * hav(dlng)
-    distance = 2 * EARTH_RADIUS * asin(pow(h, 0.5))  # km
-    # distance = int(distance * 1000)  # m
-    return distance
-
-
-class NmeaDict(dict):
-
-    @classmethod
-    def load(cls, raw):
-        items = {}
-        for line in raw.split('\r\n'):
-            try:
-                tail_index = line.rfind('*')
-                if tail_index == -1:
-                    continue
-                head_index = line.rfind('$', 0, tail_index)
-                if head_index == -1:
-                    continue
-                crc = int(line[tail_index + 1:tail_index + 3], 16)
-                if cls.checksum(line[head_index + 1:tail_index]) != crc:
-                    raise ValueError('CRC check failed')
-                cmdlist = line[head_index:tail_index].split(',')
-                # print(line[head_index:])
-                if cmdlist[0] not in items:
-                    items[cmdlist[0]] = []
-                items[cmdlist[0]].append(line)
-            except Exception as e:
-                # logger.debug('parse nmea line error: {}; pass it: {}'.format(e, line))
-                continue
-        return cls(items)
+NMEA_MAX_LENGTH = 128  # NMEA 0183 单条语句最长82字节, 留些余量
+
+
+class NmeaSentence(object):
+    """一条通过CRC校验的NMEA语句, 保存原始bytes, 字段在首次访问时才解码"""
+
+    # 纬度字段下标, 其后依次为纬度方向、经度、经度方向
+    LAT_INDEX = {b'RMC': 3, b'GGA': 2, b'GLL': 1}
+    # 定位状态字段下标
+    STATUS_INDEX = {b'RMC': 2, b'GGA': 6, b'GLL': 6, b'GSA': 2}
+    # HDOP字段下标
+    HDOP_INDEX = {b'GGA': 8, b'GSA': 16}
+
+    def __init__(self, raw):
+        self.raw = raw  # b'$GNRMC,...*7A'
+        self.__fields = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.raw)
+
+    @property
+    def name(self):
+        return self.raw[:self.raw.find(b',')]
+
+    @property
+    def type(self):
+        return self.raw[3:6]
+
+    @property
+    def text(self):
+        return self.raw.decode()
+
+    @property
+    def fields(self):
+        if self.__fields is None:
+            self.__fields = self.raw[:-3].decode().split(',')
+        return self.__fields
+
+    @property
+    def status(self):
+        # RMC/GLL: A有效 V无效; GGA: 定位质量, 0为无效; GSA: 定位模式 1无 2为2D 3为3D
+        # 其他语句(GSV/VTG等)没有定位状态, 返回空串, valid 为False
+        index = self.STATUS_INDEX.get(self.type)
+        if index is None:
+            return ''
+        raw = self.raw
+        start, end = field_span(raw, index, 0, len(raw) - 3)
+        return raw[start:end].decode()
+
+    @property
+    def valid(self):
+        status = self.status
+        if self.type == b'GGA':
+            return status not in ('', '0')
+        if self.type == b'GSA':
+            return status in ('2', '3')
+        return status == 'A'
+
+    def __coord(self, index):
+        raw = self.raw
+        start, end = field_span(raw, index, 0, len(raw) - 3)
+        value = parse_coord(raw, start, end)
+        # 紧随其后的方向字段: S/W 为负
+        return -value if raw[end + 1] in (0x53, 0x57) else value  # 'S', 'W'
+
+    @property
+    def lat_e6(self):
+        return self.__coord(self.LAT_INDEX[self.type])
+
+    @property
+    def lng_e6(self):
+        return self.__coord(self.LAT_INDEX[self.type] + 2)
+
+    def __float(self, index):
+        raw = self.raw
+        start, end = field_span(raw, index, 0, len(raw) - 3)
+        if start >= end:
+            return None
+        return float(raw[start:end].decode())
+
+    @property
+    def speed(self):
+        # RMC对地速度, 单位节, 转换为km/h
+        knots = self.__float(7)
+        return None if knots is None else knots * 1.852
+
+    @property
+    def course(self):
+        # RMC对地航向, 单位度, 静止时通常为空
+        return self.__float(8)
+
+    @property
+    def timestamp(self):
+        # RMC的UTC日期+时间, Unix秒
+        raw = self.raw
+        end = len(raw) - 3
+        time_start, _ = field_span(raw, 1, 0, end)
+        date_start, _ = field_span(raw, 9, 0, end)
+        return parse_timestamp(raw, date_start, time_start)
+
+    @property
+    def hdop(self):
+        return self.__float(self.HDOP_INDEX[self.type])
+
+    @property
+    def satellites(self):
+        # GGA参与解算的卫星数
+        value = self.__float(7)
+        return None if value is None else int(value)
+
+    @property
+    def fix_mode(self):
+        # GSA定位模式
+        value = self.__float(2)
+        return None if value is None else int(value)
+
+    @property
+    def lat(self):
+        return self.lat_e6 / COORD_SCALE
+
+    @property
+    def lng(self):
+        return self.lng_e6 / COORD_SCALE
+
+
+class NmeaParser(object):
+    """增量式NMEA解析器
+
+    quecgnss.read() 每次返回的数据块会在任意位置截断语句, 未遇到换行的尾部
+    保留到下一次feed时拼接, 其余语句直接在输入的bytes上按下标校验.
+    sentences 为语句白名单(如 ('$GNRMC', '$GNGGA')), 不在名单内的语句在
+    CRC校验之前就被跳过; 为None时不过滤.
+    """
+
+    def __init__(self, sentences=None):
+        self.__partial = b''
+        self.__sentences = None
+        self.setFilter(sentences)
+
+    def setFilter(self, sentences=None):
+        if sentences is None:
+            self.__sentences = None
+        else:
+            self.__sentences = tuple(
+                (name.encode() if isinstance(name, str) else name) + b',' for name in sentences
+            )
+
+    def reset(self):
+        self.__partial = b''
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        elif not isinstance(data, bytes):
+            data = bytes(data)  # bytearray / memoryview
+
+        start = 0
+        if self.__partial:
+            end = data.find(b'\n')
+            if end == -1:
+                self.__carry(self.__partial + data)
+                return
+            # 只有跨块的这一条语句需要拼接
+            line = self.__partial + data[:end]
+            self.__partial = b''
+            sentence = self.parse(line, 0, len(line))
+            if sentence is not None:
+                yield sentence
+            start = end + 1
+
+        size = len(data)
+        while start < size:
+            end = data.find(b'\n', start)
+            if end == -1:
+                self.__carry(data[start:])
+                break
+            sentence = self.parse(data, start, end)
+            if sentence is not None:
+                yield sentence
+            start = end + 1
+
+    def __carry(self, tail):
+        # 长时间收不到换行说明数据异常, 丢弃而不是无限累积
+        self.__partial = tail if len(tail) <= NMEA_MAX_LENGTH else b''
+
+    def parse(self, buf, start, end):
+        tail_index = buf.rfind(b'*', start, end)
+        if tail_index == -1 or tail_index + 3 > end:
+            return
+        head_index = buf.rfind(b'$', start, tail_index)
+        if head_index == -1:
+            return
+        if self.__sentences is not None and not self.accept(buf, head_index):
+            return
+        if checksum(buf, head_index + 1, tail_index) != parse_hex2(buf, tail_index + 1):
+            # logger.debug('nmea CRC check failed, pass it: {}'.format(buf[start:end]))
+            return
+        return NmeaSentence(buf[head_index:tail_index + 3])
+
+    def accept(self, buf, index):
+        for prefix in self.__sentences:
+            if buf.startswith(prefix, index):
+                return True
+        return False
+
+
+class GnssScheduler(object):
+    """根据RMC速度/航向计算下一次读取GNSS的间隔(秒)
+
+    运动时按速度折算为每行驶 MOVE_STEP 米读取一次, 转弯时立即回到最小间隔;
+    静止后间隔逐次翻倍, 直到最大间隔.
+    """
+
+    MOVE_STEP = 25  # m, 取上报阈值50m的一半, 保证不漏掉拐点
+    MOVING_SPEED = 3  # km/h, 低于该速度视为静止(GNSS漂移)
+    TURN_ANGLE = 30  # 度, 航向变化超过该值视为转弯
+
+    def __init__(self, min_interval=1, max_interval=60):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.__course = None
+
+    def setBounds(self, min_interval, max_interval):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError('invalid gnss interval bounds: {}, {}'.format(min_interval, max_interval))
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min(max(self.interval, min_interval), max_interval)
+
+    def __turned(self, course):
+        if course is None or self.__course is None:
+            return False
+        delta = abs(course - self.__course) % 360
+        return min(delta, 360 - delta) >= self.TURN_ANGLE
 
-    @staticmethod
-    def checksum(data):
-        crc = ord(data[0])
-        for one in (ord(_) for _ in data[1:]):
-            crc ^= one
-        return crc
+    def update(self, speed=None, course=None):
+        if speed is not None and speed >= self.MOVING_SPEED:
+            if self.__turned(course):
+                interval = self.min_interval
+            else:
+                interval = self.MOVE_STEP * 3.6 / speed
+            if course is not None:
+                self.__course = course
+        else:
+            # 静止或无定位: 逐步退避
+            interval = self.interval * 2
+            self.__course = None
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        return self.interval
+
+    def sleep(self):
+        utime.sleep_ms(int(self.interval * 1000))
+
+
+class FixQualityGate(object):
+    """用GGA的HDOP/卫星数和GSA的定位模式过滤劣质定位
+
+    check() 拒绝时返回None, 否则返回估计的水平误差(km), 作为位置滤波的
+    观测噪声, 降低跳点的权重. 缺少GGA/GSA时按最大HDOP估计误差.
+    """
+
+    UERE = 0.005  # km, 用户等效测距误差, 水平误差约为 HDOP * UERE
+
+    def __init__(self, max_hdop=5.0, min_satellites=4, min_fix_mode=2):
+        self.max_hdop = max_hdop
+        self.min_satellites = min_satellites
+        self.min_fix_mode = min_fix_mode
+
+    def check(self, gga=None, gsa=None):
+        hdop = None
+        if gsa is not None:
+            fix_mode = gsa.fix_mode
+            if fix_mode is None or fix_mode < self.min_fix_mode:
+                return
+            hdop = gsa.hdop
+        if gga is not None:
+            satellites = gga.satellites
+            if satellites is None or satellites < self.min_satellites:
+                return
+            hdop = gga.hdop
+        if hdop is None:
+            hdop = self.max_hdop
+        elif hdop > self.max_hdop:
+            return
+        return hdop * self.UERE
+
+
+class GnssPowerScheduler(object):
+    """GNSS占空比控制: 两次读取之间关闭GNSS, 并尽量保持热启动
+
+    每次上电后统计首次定位时间(TTFF)并分为热/温/冷启动. 关机后若不再是热启动,
+    说明关机时间超出了星历/时间保持的能力, 将最长关机时间 off_limit 缩短为
+    本次关机时间的一半; 热启动且已接近上限时再逐步放宽, 不超过 max_off.
+    上电后 fix_deadline 秒内仍未定位则放弃本轮等待.
+    """
+
+    HOT_TTFF = 5  # s
+    WARM_TTFF = 35  # s
+    MIN_OFF = 20  # s, 关机时间太短不值得开关一次
+
+    def __init__(self, max_off=1800, fix_deadline=120):
+        self.max_off = max_off  # 0 表示不关闭GNSS
+        self.fix_deadline = fix_deadline
+        self.off_limit = max_off
+        self.stats = {'hot': 0, 'warm': 0, 'cold': 0, 'timeout': 0}
+        self.__on_ticks = None  # 非None表示上电后正在等待定位
+        self.__off_ticks = None
+        self.__off_duration = 0
+
+    @property
+    def acquiring(self):
+        return self.__on_ticks is not None
+
+    @property
+    def off(self):
+        return self.__off_ticks is not None
+
+    def offPeriod(self, interval):
+        if self.max_off <= 0:
+            return 0
+        off = min(interval, self.off_limit)
+        return off if off >= self.MIN_OFF else 0
+
+    def poweredOff(self, ticks):
+        self.__off_ticks = ticks
+
+    def poweredOn(self, ticks):
+        if self.__off_ticks is None:
+            self.__off_duration = 0
+        else:
+            self.__off_duration = utime.ticks_diff(ticks, self.__off_ticks) / 1000
+            self.__off_ticks = None
+        self.__on_ticks = ticks
+
+    def fixed(self, ticks):
+        if self.__on_ticks is None:
+            return
+        ttff = utime.ticks_diff(ticks, self.__on_ticks) / 1000
+        self.__on_ticks = None
+        if ttff <= self.HOT_TTFF:
+            start = 'hot'
+            if self.__off_duration >= self.off_limit * 0.8:
+                self.off_limit = min(self.max_off, self.off_limit * 1.25)
+        else:
+            start = 'warm' if ttff <= self.WARM_TTFF else 'cold'
+            if self.__off_duration > 0:
+                self.off_limit = max(self.MIN_OFF, self.__off_duration / 2)
+        self.stats[start] += 1
+        logger.debug('gnss {} start, ttff {:.1f}s after {:.0f}s off, off limit {:.0f}s, stats {}'.format(
+            start, ttff, self.__off_duration, self.off_limit, self.stats))
+
+    def check(self, ticks):
+        if self.__on_ticks is None:
+            return
+        if utime.ticks_diff(ticks, self.__on_ticks) / 1000 >= self.fix_deadline:
+            self.__on_ticks = None
+            self.stats['timeout'] += 1
+            logger.warn('gnss no fix within {}s, stats {}'.format(self.fix_deadline, self.stats))
 
 
 class GnssService(object):
 
     def __init__(self, app=None):
         self.__gnss = quecgnss
+        self.__parser = NmeaParser(NMEA_SENTENCES)
+        self.__scheduler = GnssScheduler()
+        self.__quality = FixQualityGate()
+        self.__track = TrackBuffer()
+        self.__geofence = GeofenceEngine()
+        self.__fence_events = []  # 待上报的围栏事件, 按发生顺序
+        self.__odometer = Odometer()
+        self.__power = GnssPowerScheduler()
+        self.__distance = DistanceEngine()  # 参考点为上一次成功上报的位置
+        self.__filter = PositionFilter()  # 位移阈值比较的是滤波后的位置
+        self.__reported_total = None
+        self.__fix_ticks = None
+        self.__lost_ticks = None  # 开始没有有效定位的时间, None表示定位正常
+        self.__utc_offset = None  # RMC的UTC秒 - utime.time()
+        self.__last_nmea = None  # 最近一次有效定位的语句
+        self.managed = False  # 由 LocationService 驱动时不启动自己的线程
+        self.ready = False
         if app is not None:
             self.init_app(app)
 
@@ -106,13 +416,36 @@ class GnssService(object):
 
     def init_app(self, app):
         app.register('gnss_service', self)
+        self.__parser.setFilter(app.config.get('GNSS_NMEA_SENTENCES', NMEA_SENTENCES))
+        self.__scheduler.setBounds(
+            app.config.get('GNSS_INTERVAL_MIN', self.__scheduler.min_interval),
+            app.config.get('GNSS_INTERVAL_MAX', self.__scheduler.max_interval)
+        )
+        self.__quality.max_hdop = app.config.get('GNSS_MAX_HDOP', self.__quality.max_hdop)
+        self.__quality.min_satellites = app.config.get('GNSS_MIN_SATELLITES', self.__quality.min_satellites)
+        self.__track.tolerance = app.config.get('TRACK_TOLERANCE', self.__track.tolerance)
+        self.__track.max_points = app.config.get('TRACK_MAX_POINTS', self.__track.max_points)
+        self.__track.max_age = app.config.get('TRACK_MAX_AGE', self.__track.max_age)
+        self.__track.turn_angle = app.config.get('TRACK_TURN_ANGLE', self.__track.turn_angle)
+        try:
+            self.__geofence.cell_size = app.config.get('GEOFENCE_CELL_SIZE', self.__geofence.cell_size)
+        except (TypeError, ValueError) as e:
+            logger.error('{} {}, keep {}'.format(self, e, self.__geofence.cell_size))
+        for config, error in self.__geofence.load(app.config.get('GEOFENCES', [])):
+            logger.error('{} skip geofence {}: {}'.format(self, config, error))
+        logger.info('{} loaded {} geofences'.format(self, self.__geofence.count))
+        self.__power.max_off = self.__power.off_limit = app.config.get('GNSS_MAX_OFF', self.__power.max_off)
+        self.__power.fix_deadline = app.config.get('GNSS_FIX_DEADLINE', self.__power.fix_deadline)
 
     def load(self):
         logger.info('loading {} extension, init quecgnss will take some seconds'.format(self))
         result = self.init()
         logger.info('{} init gnss res: {}'.format(self, result))
         if result:
-            Thread(target=self.start_update).start()
+            self.__odometer.load()
+            self.ready = True
+            if not self.managed:
+                Thread(target=self.start_update).start()
 
     def init(self):
         if self.__gnss.init() != 0:
@@ -134,92 +467,209 @@ class GnssService(object):
         if raw != -1:
             size, data = raw
             # logger.debug('gnss read raw {} bytes data:\n{}'.format(size, data))
-            return NmeaDict.load(data)
+            return self.__parser.feed(data)
+
+    def suspend(self):
+        """为下一次读取做准备, 值得时关闭GNSS, 返回距下一次读取的秒数"""
+        if self.__power.acquiring:
+            # 刚上电等待定位, 按最小间隔读取
+            return self.__scheduler.min_interval
+        off = self.__power.offPeriod(self.__scheduler.interval)
+        if not off or not self.enable(False):
+            return self.__scheduler.interval
+        self.__power.poweredOff(utime.ticks_ms())
+        return off
+
+    def resume(self):
+        if not self.__power.off:
+            return
+        if not self.enable(True):
+            logger.error('{} gnss enable FAILED'.format(self))
+        self.__power.poweredOn(utime.ticks_ms())
+        self.__parser.reset()  # 关机前残留的半截语句作废
+
+    def sleep(self):
+        utime.sleep_ms(int(self.suspend() * 1000))
+        self.resume()
+
+    def __sendTrack(self, qth_client, payload, nmea_data):
+        if not qth_client.sendTrack(payload):
+            return False
+        # 轨迹走透传, 最新位置仍按定位上报, 供平台显示当前位置
+        if nmea_data is not None:
+            qth_client.sendGnss(nmea_data)
+        return True
 
-    def start_update(self):
-        prev_lat_and_lng = None
+    def uploadTrack(self, nmea_data=None):
+        points = self.__track.flush()
+        if not points:
+            return True
+        payload = encode_track(points)
+        qth_client = CurrentApp().qth_client
+        if qth_client.call(self.__sendTrack, qth_client, payload, nmea_data):
+            logger.debug("send {} track points to qth server success".format(len(points)))
+            return True
+        logger.error("send track to qth server fail, keep {} points for next batch".format(len(points)))
+        self.__track.restore(points)
+        return False
+
+    def __trackTime(self, rmc):
+        """轨迹时间戳用RMC的UTC秒; 没有RMC时按上次RMC与本地时钟的差推算"""
+        if rmc is not None:
+            self.__utc_offset = rmc.timestamp - utime.time()
+            return rmc.timestamp
+        if self.__utc_offset is None:
+            return None
+        return utime.time() + self.__utc_offset
+
+    def __checkTrack(self, rmc=None, nmea_data=None):
+        # 每次读取都检查, 没有定位(隧道/车库/改用LBS)时缓存的轨迹也能按 max_age 上报
+        if nmea_data is not None:
+            self.__last_nmea = nmea_data
+        now = self.__trackTime(rmc)
+        if now is not None and self.__track.ready(now):
+            # 没有新定位时随轨迹补报最后一次有效定位
+            self.uploadTrack(self.__last_nmea)
+
+    def getOdometer(self):
+        return round(self.__odometer.total, 2), round(self.__odometer.trip, 2)
+
+    def reportOdometer(self):
+        total, trip = self.getOdometer()
+        qth_client = CurrentApp().qth_client
+        if qth_client.call(qth_client.sendTsl, 1, {TSL_ID_ODOMETER: total, TSL_ID_TRIP: trip}):
+            return True
+        logger.error("send odometer to qth server fail")
+        return False
+
+    def reportGeofence(self, events=()):
+        """按顺序上报围栏事件, 失败的连同之后的事件留到下次再发"""
+        pending = self.__fence_events
+        for fence_id, entered in events:
+            logger.debug('geofence {} {}'.format(fence_id, 'enter' if entered else 'exit'))
+            pending.append((fence_id, entered))
+        if len(pending) > GEOFENCE_PENDING_MAX:
+            logger.warn("drop {} geofence events".format(len(pending) - GEOFENCE_PENDING_MAX))
+            del pending[:len(pending) - GEOFENCE_PENDING_MAX]
+        qth_client = CurrentApp().qth_client
+        while pending:
+            fence_id, entered = pending[0]
+            if not qth_client.call(qth_client.sendTsl, 1, {TSL_ID_GEOFENCE: {1: fence_id, 2: 1 if entered else 0}}):
+                logger.error("send geofence event to qth server fail, keep {} events".format(len(pending)))
+                return False
+            pending.pop(0)
+        return True
 
-        while True:
-            nmea_dict = self.read()
-            if nmea_dict is None:
-                utime.sleep(3)
-                continue
+    def __lost(self, ticks):
+        if self.__lost_ticks is None:
+            self.__lost_ticks = ticks
+
+    def noFixTime(self, ticks):
+        """持续没有有效定位的时间(秒), 定位正常时为0"""
+        if self.__lost_ticks is None:
+            return 0
+        return utime.ticks_diff(ticks, self.__lost_ticks) / 1000
+
+    def start(self):
+        self.__power.poweredOn(utime.ticks_ms())
+        self.__lost(utime.ticks_ms())
+
+    def update(self):
+        """读取并处理一次GNSS数据, 返回是否得到了有效定位"""
+        global GLOBAL_DISTANCE
+        sentences = self.read()
+        if sentences is None:
+            self.__scheduler.update()
+            self.__power.check(utime.ticks_ms())
+            self.__lost(utime.ticks_ms())
+            self.__checkTrack()
+            return False
 
-            nmea_data = None
-
-            if nmea_data is None:
-                if "$GNRMC" in nmea_dict:
-                    for temp in nmea_dict["$GNRMC"]:
-                        nmea_tuple = temp.split(",")
-                        if nmea_tuple[2] == "A":
-                            nmea_data = temp
-
-                            lat_string = nmea_tuple[3]
-                            lat_high = float(lat_string[:2])
-                            lat_low = float(lat_string[2:]) / 60
-                            lat = lat_high + lat_low
-                            if nmea_tuple[4] == "S":
-                                lat = -lat
-                            
-                            lng_string = nmea_tuple[5]  # 11755.787896484374（单位：分）
-                            lng_high = float(lng_string[:3])
-                            lng_low = float(lng_string[3:]) / 60
-                            lng = lng_high + lng_low
-                            if nmea_tuple[6] == "W":
-                                lng = -lng
-
-                            break
-
-            if nmea_data is None:
-                if "$GNGGA" in nmea_dict:
-                    for temp in nmea_dict["$GNGGA"]:
-                        nmea_tuple = temp.split(",")
-                        if nmea_tuple[6] != "0":
-                            nmea_data = temp
-
-                            lat_string = nmea_tuple[2]
-                            lat_high = float(lat_string[:2])
-                            lat_low = float(lat_string[2:]) / 60
-                            lat = lat_high + lat_low
-                            if nmea_tuple[3] == "S":
-                                lat = -lat
-
-                            lng_string = nmea_tuple[4]  # 11755.787896484374（单位：分）
-                            lng_high = float(lng_string[:3])
-                            lng_low = float(lng_string[3:]) / 60
-                            lng = lng_high + lng_low
-                            if nmea_tuple[5] == "W":
-                                lng = -lng
-                                
-                            break
-            
-            if nmea_data is not None:
-                # logger.debug("GPS data: {}".format(nmea_data))
-                # logger.debug("prev_lat_and_lng: {}".format(prev_lat_and_lng))
-                logger.debug("lat_and_lng: {}".format((lat, lng)))
-                if prev_lat_and_lng is None:
-                    # 首次定位
-                    for _ in range(3):
-                        with CurrentApp().qth_client:
-                            if CurrentApp().qth_client.sendGnss(nmea_data):
-                                prev_lat_and_lng = (lat, lng)
-                                logger.error("send gnss to qth server success")
-                                break
-                    else:
-                        logger.error("send gnss to qth server fail")
+        # 一次read可能包含多个定位周期, 保留最新的有效语句
+        rmc = None
+        gga = None
+        gsa = None
+        for sentence in sentences:
+            kind = sentence.type
+            if kind == b'GSA':
+                gsa = sentence  # 定位模式交给质量门限判断
+            elif kind != b'RMC' and kind != b'GGA':
+                continue  # GNSS_NMEA_SENTENCES 放行的其他语句这里用不到
+            elif not sentence.valid:
+                continue
+            elif kind == b'RMC':
+                rmc = sentence
+            else:
+                gga = sentence
+
+        nmea_data = None
+
+        if rmc is not None:
+            self.__scheduler.update(rmc.speed, rmc.course)
+        else:
+            self.__scheduler.update()
+
+        sentence = rmc if rmc is not None else gga
+        if sentence is not None:
+            accuracy = self.__quality.check(gga, gsa)
+            if accuracy is None:
+                logger.debug('poor gnss fix, pass it: {}'.format(sentence.raw))
+                sentence = None
+
+        if sentence is None:
+            self.__power.check(utime.ticks_ms())
+            self.__lost(utime.ticks_ms())
+        else:
+            nmea_data = sentence.text
+            now = utime.ticks_ms()
+            self.__power.fixed(now)
+            self.__lost_ticks = None
+            dt = 0 if self.__fix_ticks is None else utime.ticks_diff(now, self.__fix_ticks) / 1000
+            self.__fix_ticks = now
+            # 误差大的定位方差大, 对滤波结果的影响也小
+            speed = rmc.speed if rmc is not None else None
+            self.__filter.update(sentence.lat, sentence.lng, accuracy * 1000, dt, None if speed is None else speed / 3.6)
+            lat = self.__filter.lat
+            lng = self.__filter.lng
+            events = self.__geofence.update(lat, lng)
+            if events or self.__fence_events:
+                self.reportGeofence(events)
+            if self.__odometer.update(lat, lng, utime.time()):
+                GLOBAL_DISTANCE = self.__odometer.total
+                trip_ended = not self.__odometer.moving
+                if self.__reported_total is None or trip_ended or \
+                        GLOBAL_DISTANCE - self.__reported_total >= ODOMETER_REPORT_STEP:
+                    if self.reportOdometer():
+                        self.__reported_total = GLOBAL_DISTANCE
+
+        if nmea_data is not None:
+            # logger.debug("GPS data: {}".format(nmea_data))
+            # logger.debug("prev_lat_and_lng: {}".format(self.__distance.reference))
+            logger.debug("lat_and_lng: {}".format((lat, lng)))
+            if self.__distance.reference is None:
+                # 首次定位
+                qth_client = CurrentApp().qth_client
+                if qth_client.call(qth_client.sendGnss, nmea_data):
+                    self.__distance.setReference(lat, lng)
+                    logger.debug("send gnss to qth server success")
                 else:
-                    # 或者位移超过 50m，则上报
-                    distance = gps_distance(prev_lat_and_lng[0], prev_lat_and_lng[1], lat, lng)
-                    logger.debug('distance delta: {:f}'.format(distance))
-                    if distance >= 0.05:
-                        for _ in range(3):
-                            with CurrentApp().qth_client:
-                                if CurrentApp().qth_client.sendGnss(nmea_data):
-                                    prev_lat_and_lng = (lat, lng)
-                                    logger.error("send gnss to qth server success")
-                                    break
-                        else:
-                            logger.error("send gnss to qth server fail")
-            utime.sleep(3)
+                    logger.error("send gnss to qth server fail")
+                if self.__distance.reference is not None and rmc is not None:
+                    self.__track.append(rmc.timestamp, lat, lng, rmc.course)
+            else:
+                # 位移超过 50m 的定位进入轨迹缓存, 按批上报
+                moved = self.__distance.exceeds(lat, lng, MOVE_THRESHOLD)
+                logger.debug('moved over {} km: {}, accuracy: {:f}'.format(MOVE_THRESHOLD, moved, accuracy))
+                if moved:
+                    self.__distance.setReference(lat, lng)
+                    if rmc is not None:
+                        self.__track.append(rmc.timestamp, lat, lng, rmc.course)
 
+        self.__checkTrack(rmc, nmea_data)
+        return nmea_data is not None
 
+    def start_update(self):
+        self.start()
+        while True:
+            self.update()
+            self.sleep()
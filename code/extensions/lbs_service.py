@@ -7,11 +7,61 @@ import _thread
 
 logger = getLogger(__name__)
 
+# net.getCellInfo() LTE 元组下标
+CELL_ID = 1
+CELL_MCC = 2
+CELL_MNC = 3
+CELL_TAC = 5
+CELL_RSRP = 7
+
+
+class CellChangeDetector(object):
+    """服务小区缓存, 判断本次查询到的小区是否需要上报
+
+    小区以 (MCC, MNC, LAC/TAC, cell ID) 为键. 发生切换、信号变化超过
+    rsrp_delta, 或距上次成功上报超过 heartbeat 秒时才需要上报;
+    静止设备绝大多数查询结果与缓存一致, 不产生上行.
+    """
+
+    RSRP_DELTA = 10  # dB
+    HEARTBEAT = 1800  # s
+
+    def __init__(self, rsrp_delta=RSRP_DELTA, heartbeat=HEARTBEAT):
+        self.rsrp_delta = rsrp_delta
+        self.heartbeat = heartbeat
+        self.__key = None
+        self.__rsrp = None
+        self.__time = None
+
+    def check(self, key, rsrp, now):
+        """:return: 上报原因 'handover' / 'signal' / 'heartbeat', 无需上报时为None"""
+        if key != self.__key:
+            return 'handover'
+        if abs(rsrp - self.__rsrp) >= self.rsrp_delta:
+            return 'signal'
+        if now - self.__time >= self.heartbeat:
+            return 'heartbeat'
+        return None
+
+    def reset(self):
+        # 清空缓存, 下一次查询必定上报
+        self.__key = None
+
+    def commit(self, key, rsrp, now):
+        # 上报成功后才更新缓存, 失败时下一次查询仍会触发上报
+        self.__key = key
+        self.__rsrp = rsrp
+        self.__time = now
+
 
 class LbsService(object):
 
     def __init__(self, app=None):
         self.__net = net
+        self.__detector = CellChangeDetector()
+        self.__interval = 10  # s, 查询服务小区的间隔, 查询本身不产生上行
+        self.max_cells = 5  # 一次上报的小区数上限(含服务小区)
+        self.managed = False  # 由 LocationService 驱动时不启动自己的线程
         if app is not None:
             self.init_app(app)
 
@@ -21,56 +71,111 @@ class LbsService(object):
 
     def init_app(self, app):
         app.register('lbs_service', self)
+        self.__interval = app.config.get('LBS_POLL_INTERVAL', self.__interval)
+        self.__detector.rsrp_delta = app.config.get('LBS_RSRP_DELTA', self.__detector.rsrp_delta)
+        self.__detector.heartbeat = app.config.get('LBS_HEARTBEAT', self.__detector.heartbeat)
+        self.max_cells = app.config.get('LBS_MAX_CELLS', self.max_cells)
 
     def load(self):
         logger.info('loading {} extension, init lbs will take some seconds'.format(self))
-        Thread(target=self.start_update).start()
+        if not self.managed:
+            Thread(target=self.start_update).start()
 
-    def read(self):
+    def cells(self):
+        """:return: [服务小区, 邻区...] LTE元组列表, 查询失败时为None
+
+        邻区按信号由强到弱排列, 连同服务小区最多 max_cells 个;
+        缺少小区ID/TAC的邻区(只测到PCI)和重复的小区被丢弃.
+        """
         cell_info = net.getCellInfo()
-        if cell_info != -1 and cell_info[2]:
-            first_tuple = cell_info[2]
-            mcc_decimal = first_tuple[0][2]  # 获取十进制MCC (如1120)
-            mcc_hex = "{:x}".format(mcc_decimal).upper()  # 转换为十六进制 (如'460')
+        if cell_info == -1 or not cell_info[2]:
+            return None
+        lte = cell_info[2]
+        serving = lte[0]
+        seen = set((serving[CELL_ID],))
+        neighbours = []
+        for index in range(1, len(lte)):
+            cell = lte[index]
+            if cell[CELL_ID] and cell[CELL_TAC] and cell[CELL_ID] not in seen:
+                seen.add(cell[CELL_ID])
+                neighbours.append(cell)
+        neighbours.sort(key=lambda cell: cell[CELL_RSRP], reverse=True)
+        del neighbours[self.max_cells - 1:]
+        neighbours.insert(0, serving)
+        return neighbours
 
-            lbs_data = "$LBS,{},{},{},{},{},0*69;".format(
+    def format(self, cells):
+        """每个小区一条 $LBS 语句, 最后一个字段 0 为服务小区, 1 为邻区"""
+        serving = cells[0]
+        items = []
+        for index in range(len(cells)):
+            cell = cells[index]
+            # 部分模组邻区不带MCC/MNC, 沿用服务小区的
+            plmn = cell if cell[CELL_MCC] else serving
+            mcc_decimal = plmn[CELL_MCC]  # 获取十进制MCC (如1120)
+            mcc_hex = "{:x}".format(mcc_decimal).upper()  # 转换为十六进制 (如'460')
+            items.append("$LBS,{},{},{},{},{},{}*69;".format(
                 mcc_hex,
-                first_tuple[0][3],
-                first_tuple[0][5],
-                first_tuple[0][1],
-                first_tuple[0][7]
-            )
-            # lbs_data = "$LBS,460,0,15419,128230431,78,0*69;"
-            return lbs_data
+                plmn[CELL_MNC],
+                cell[CELL_TAC],
+                cell[CELL_ID],
+                cell[CELL_RSRP],
+                0 if index == 0 else 1
+            ))
+        # lbs_data = "$LBS,460,0,15419,128230431,78,0*69;"
+        return ''.join(items)
+
+    def read(self):
+        cells = self.cells()
+        if cells is not None:
+            return self.format(cells)
+
+    def reset(self):
+        """忘记上次上报的小区, 下一次 update 必定上报"""
+        self.__detector.reset()
+
+    def update(self):
+        """查询一次服务小区, 需要时上报
+
+        :return: 距下一次查询的秒数; 上报失败时为None, 由调用方按退避策略等待
+        """
+        cells = self.cells()
+        if cells is None:
+            return 2
+        cell = cells[0]
+
+        key = (cell[CELL_MCC], cell[CELL_MNC], cell[CELL_TAC], cell[CELL_ID])
+        now = utime.time()
+        reason = self.__detector.check(key, cell[CELL_RSRP], now)
+        if reason is None:
+            return self.__interval
+
+        state = CurrentApp().qth_client.isStatusOk()
+        logger.debug('qth state {}'.format(state))
+        if not state:
+            logger.error('qth client status error, not update lbs data')
+            return self.__interval
+
+        logger.debug('qth client status ok, start updata lbs data, reason: {}'.format(reason))
+        lbs_data = self.format(cells)
+        qth_client = CurrentApp().qth_client
+
+        if not qth_client.call(qth_client.sendLbs, lbs_data):
+            logger.debug("send lbs data to qth server fail, retry after {:.1f} seconds".format(qth_client.retry.remaining()))
+            return None
+
+        self.__detector.commit(key, cell[CELL_RSRP], now)
+        logger.debug("send lbs data to qth server success")
+        return self.__interval
 
     def start_update(self):
         while True:
-            lbs_data = self.read()
-            if lbs_data is None:
-                utime.sleep(2)
-                continue
-            
-            state = CurrentApp().qth_client.isStatusOk()
-            logger.debug('qth state {}'.format(state))
-            if not state:
-                logger.error('qth client status error, not update lbs data')
+            delay = self.update()
+            if delay is None:
+                CurrentApp().qth_client.retry.wait()
             else:
-                logger.debug('qth client status ok, start updata lbs data')
-
-                for _ in range(3):
-                    with CurrentApp().qth_client:
-                        if CurrentApp().qth_client.sendLbs(lbs_data):
-                            break
-                else:
-                    logger.debug("send lbs data to qth server fail, next report will be after 2 seconds")
-                    utime.sleep(2)
-                    continue
-                
-                # logger.debug("send lbs data to qth server success, next report will be after 1800 seconds")
-                # utime.sleep(1800)
-                logger.debug("send lbs data to qth server success, next report will be after 10 seconds")
-                utime.sleep(10)
-            
+                utime.sleep(delay)
+
     def put_lbs(self):
             while True:
                 lbs_data = self.read()
@@ -78,13 +183,10 @@ class LbsService(object):
                     utime.sleep(2)
                     continue
 
-                for _ in range(3):
-                    with CurrentApp().qth_client:
-                        if CurrentApp().qth_client.sendLbs(lbs_data):
-                            break
-                else:
-                    logger.debug("send lbs data to qth server fail, next report will be after 2 seconds")
-                    utime.sleep(2)
+                qth_client = CurrentApp().qth_client
+                if not qth_client.call(qth_client.sendLbs, lbs_data):
+                    logger.debug("send lbs data to qth server fail, retry after {:.1f} seconds".format(qth_client.retry.remaining()))
+                    qth_client.retry.wait()
                     continue
                 
                 logger.debug("send LBS data to qth server success")
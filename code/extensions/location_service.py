@@ -0,0 +1,127 @@
+import utime
+from usr.libs import CurrentApp
+from usr.libs.threading import Thread
+from usr.libs.logging import getLogger
+
+logger = getLogger(__name__)
+
+
+LBS_ACCURACY = 1000  # m, 基站定位的典型误差
+ERROR_RETRY_DELAY = 5  # s, 定位源异常后隔多久再试
+
+
+class LocationService(object):
+    """在一个线程里驱动 GnssService 和 LbsService
+
+    要求的精度 LBS 就能满足时只用基站定位, 不开GNSS; 否则以GNSS为主,
+    GNSS正常时不做基站上报, 持续 fallback 秒没有有效定位才改用基站定位,
+    重新定位后再切回. 需在 gnss_service / lbs_service 之后注册.
+    """
+
+    def __init__(self, app=None):
+        self.accuracy = 50  # m, 业务要求的定位精度
+        self.fallback = 120  # s
+        self.source = None  # 'gnss' / 'lbs'
+        self.__gnss = None
+        self.__lbs = None
+        if app is not None:
+            self.init_app(app)
+
+    def __str__(self):
+        return '{}'.format(type(self).__name__)
+
+    def init_app(self, app):
+        app.register('location_service', self)
+        self.accuracy = app.config.get('LOCATION_ACCURACY', self.accuracy)
+        self.fallback = app.config.get('LOCATION_FALLBACK', self.fallback)
+        self.__gnss = self.__provider(app, 'gnss_service')
+        self.__lbs = self.__provider(app, 'lbs_service')
+
+    def __provider(self, app, name):
+        try:
+            provider = getattr(app, name)
+        except KeyError:
+            return None
+        provider.managed = True
+        return provider
+
+    def load(self):
+        logger.info('loading {} extension, gnss: {}, lbs: {}'.format(self, self.__gnss is not None, self.__lbs is not None))
+        Thread(target=self.start_update).start()
+
+    def __select(self, source):
+        """:return: 是否发生了切换"""
+        if source == self.source:
+            return False
+        logger.info('{} location source {} -> {}'.format(self, self.source, source))
+        self.source = source
+        return True
+
+    def start_update(self):
+        gnss = self.__gnss
+        lbs = self.__lbs
+        if gnss is not None and not gnss.ready:
+            gnss = None
+        if gnss is not None and lbs is not None and self.accuracy >= LBS_ACCURACY:
+            # 基站定位已满足精度要求, 关闭GNSS省电
+            gnss.enable(False)
+            gnss = None
+        if gnss is None and lbs is None:
+            logger.warn('{} no location provider'.format(self))
+            return
+        if gnss is not None:
+            gnss.start()
+
+        retry = CurrentApp().qth_client.retry
+        now = utime.ticks_ms()
+        gnss_next = now
+        lbs_next = now
+        lbs_backoff = False  # LBS上报失败, 等待共享退避
+        while True:
+            now = utime.ticks_ms()
+            if gnss is not None and utime.ticks_diff(gnss_next, now) <= 0:
+                try:
+                    gnss.resume()
+                    gnss.update()
+                    delay = gnss.suspend()
+                except Exception as e:
+                    # 单个定位源异常不影响另一个
+                    logger.error('{} gnss update error:{}'.format(self, e))
+                    delay = ERROR_RETRY_DELAY
+                gnss_next = utime.ticks_add(utime.ticks_ms(), int(delay * 1000))
+
+            now = utime.ticks_ms()
+            use_lbs = lbs is not None and (gnss is None or gnss.noFixTime(now) >= self.fallback)
+            if self.__select('lbs' if use_lbs else 'gnss') and use_lbs and gnss is not None:
+                # GNSS刚失效: 上次LBS上报可能是很久以前, 不论小区是否变化都立即上报一次
+                lbs.reset()
+                lbs_next = now
+            if use_lbs and utime.ticks_diff(lbs_next, now) <= 0:
+                lbs_backoff = False
+                try:
+                    delay = lbs.update()
+                    if delay is None:
+                        # 上报失败, 按共享的退避间隔再试
+                        lbs_backoff = True
+                        delay = max(retry.remaining(), 1)
+                except Exception as e:
+                    logger.error('{} lbs update error:{}'.format(self, e))
+                    delay = ERROR_RETRY_DELAY
+                lbs_next = utime.ticks_add(utime.ticks_ms(), int(delay * 1000))
+
+            # 睡到下一个到期的定位源
+            now = utime.ticks_ms()
+            wait = None
+            if gnss is not None:
+                wait = utime.ticks_diff(gnss_next, now)
+            if use_lbs:
+                lbs_wait = utime.ticks_diff(lbs_next, now)
+                wait = lbs_wait if wait is None else min(wait, lbs_wait)
+            if wait > 0:
+                if use_lbs and lbs_backoff:
+                    # 链路恢复(linkUp)时提前醒来, LBS立即重新上报
+                    retry.wait(wait / 1000)
+                    if retry.ready():
+                        lbs_next = utime.ticks_ms()
+                else:
+                    utime.sleep_ms(wait)
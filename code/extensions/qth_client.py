@@ -3,18 +3,24 @@ from usr.libs import CurrentApp
 try:
     from libs.threading import Lock
     from libs.logging import getLogger
+    from libs.retry import RetryPolicy
 except ImportError:
     from usr.libs.threading import Lock
     from usr.libs.logging import getLogger
+    from usr.libs.retry import RetryPolicy
 
 from . import lbs_service
 logger = getLogger(__name__)
 
+# devEvent 事件类型, SDK 只上报连接成功, 断链需通过 Qth.state() 检测
+QTH_EVENT_ACCESS = 2  # 接入平台
+
 
 class QthClient(object):
 
     def __init__(self, app=None):
         self.opt_lock = Lock()
+        self.retry = RetryPolicy()  # 所有上行共用的退避策略
         if app:
             self.init_app(app)
     
@@ -27,6 +33,8 @@ class QthClient(object):
 
     def init_app(self, app):
         app.register("qth_client", self)
+        self.retry.base = app.config.get("QTH_RETRY_BASE", self.retry.base)
+        self.retry.max_interval = app.config.get("QTH_RETRY_MAX_INTERVAL", self.retry.max_interval)
         Qth.init()               
         Qth.setProductInfo(app.config["QTH_PRODUCT_KEY"], app.config["QTH_PRODUCT_SECRET"])
         Qth.setServer(app.config["QTH_SERVER"])
@@ -52,6 +60,21 @@ class QthClient(object):
     
     def stop(self):
         Qth.stop()
+
+    def __locked(self, func, *args):
+        with self:
+            return func(*args)
+
+    def call(self, func, *args):
+        """在操作锁内调用 func(*args), 失败时按共享的退避策略重试"""
+        if Qth.state():
+            if not self.retry.online:
+                self.retry.linkUp()
+        elif self.retry.online:
+            logger.warn("qth link lost, back off until reconnected")
+            self.retry.linkDown()
+        return self.retry.run(self.__locked, func, *args)
+
     def sendTsl(self, mode, value):
         return Qth.sendTsl(mode, value)
 
@@ -64,9 +87,13 @@ class QthClient(object):
     def sendGnss(self, nmea_data):
         return Qth.sendOutsideLocation(nmea_data)
 
+    def sendTrack(self, payload):
+        return Qth.sendTrans(1, payload)
+
     def eventCallback(self, event, result):
         logger.info("dev event:{} result:{}".format(event, result))
-        if(2== event and 0 == result):
+        if QTH_EVENT_ACCESS == event and 0 == result:
+            self.retry.linkUp()
             Qth.otaRequest()
 
     def recvTransCallback(self, value):
@@ -97,6 +124,17 @@ class QthClient(object):
                 value[6]=press
             elif 7 == id:
                 value[7]={1:r, 2:g, 3:b}
+            elif 9 == id or 10 == id:
+                try:
+                    total, trip = CurrentApp().gnss_service.getOdometer()
+                except KeyError:
+                    # gnss_service 未加载
+                    continue
+                value[id] = total if 9 == id else trip
+            elif 11 == id or 12 == id:
+                # 与上面的RGB同一次读数换算
+                lux, cct = CurrentApp().sensor_service.get_lux_and_cct()
+                value[id] = lux if 11 == id else cct
         Qth.ackTsl(1, value, pkgId)
        
         
@@ -1,7 +1,7 @@
 import utime
 from machine import I2C
 from usr.libs import CurrentApp
-from usr.libs.threading import Thread
+from usr.libs.threading import Thread, Event
 from usr.libs.logging import getLogger
 from usr.drivers.shtc3 import Shtc3, SHTC3_SLAVE_ADDR
 from usr.drivers.lps22hb import Lps22hb, LPS22HB_SLAVE_ADDRESS
@@ -10,6 +10,9 @@ from usr.drivers.tcs34725 import Tcs34725, TCS34725_SLAVE_ADDR
 
 logger = getLogger(__name__)
 
+TSL_ID_LUX = 11  # 照度 lux
+TSL_ID_CCT = 12  # 色温 K
+
 
 class SensorService(object):
 
@@ -22,9 +25,16 @@ class SensorService(object):
         # LPS22HB
         self.lps22hb = Lps22hb(self.i2c_channel0, LPS22HB_SLAVE_ADDRESS)
         self.lps22hb.init()
+        self.pressure_samples = []  # 连续模式下最近一次从FIFO读出的样本, 供海拔/开门检测使用
         # TCS34725
         self.tcs34725 = Tcs34725(self.i2c_channel0, TCS34725_SLAVE_ADDR)
         self.tcs34725.init()
+        self.__light_interrupt = False
+        self.__light_ratio = 0.2  # clear通道变化超过该比例触发中断
+        self.__light_persistence = Tcs34725.TCS34725_PERS_5_CYCLE
+        self.__light_changed = Event()
+        self.__lux_deadband = 0.1  # 照度相对变化超过该比例才上报
+        self.__cct_deadband = 200  # K
 
         if app is not None:
             self.init_app(app)
@@ -34,17 +44,47 @@ class SensorService(object):
 
     def init_app(self, app):
         app.register('sensor_service', self)
+        self.shtc3.setLowPower(app.config.get('SHTC3_LOW_POWER', False))
+        odr = app.config.get('LPS22HB_ODR', 0)
+        if odr:
+            self.lps22hb.startStream(odr, app.config.get('LPS22HB_WATERMARK', 16))
+        if app.config.get('TCS34725_INTERRUPT', False):
+            self.__light_ratio = app.config.get('TCS34725_THRESHOLD', self.__light_ratio)
+            self.__light_persistence = app.config.get('TCS34725_PERSISTENCE', self.__light_persistence)
+            self.__light_interrupt = True
+            self.tcs34725.callback = self.__onLightChanged
+        self.tcs34725.agc = app.config.get('TCS34725_AGC', False)
+        self.__lux_deadband = app.config.get('LUX_DEADBAND', self.__lux_deadband)
+        self.__cct_deadband = app.config.get('CCT_DEADBAND', self.__cct_deadband)
 
     def load(self):
         logger.info('loading {} extension, init sensors will take some seconds'.format(self))
         Thread(target=self.start_update).start()
 
 
+    def __onLightChanged(self, args):
+        self.__light_changed.set()
+
     def get_temp1_and_humi(self):
         return self.shtc3.getTempAndHumi()
     
     def get_press_and_temp2(self):
         return self.lps22hb.getTempAndPressure()
+
+    def read_press_and_temp2(self):
+        """单次模式测量一次; 连续模式读出FIFO, 返回样本均值, 没有新样本时为None"""
+        if not self.lps22hb.streaming:
+            return self.lps22hb.getTempAndPressure()
+        samples = self.lps22hb.readFifo()
+        if self.lps22hb.overrun:
+            logger.warn("lps22hb fifo overrun, samples lost")
+        if not samples:
+            return None
+        self.pressure_samples = samples
+        press = sum(sample[0] for sample in samples) / len(samples)
+        temp2 = sum(sample[1] for sample in samples) / len(samples)
+        return press, temp2
+
     def get_rgb888(self):
             rgb888 = self.tcs34725.getRGBValue()
             logger.debug("R: {}, G: {}, B: {}".format((rgb888 >> 16) & 0xFF, (rgb888 >> 8) & 0xFF, rgb888 & 0xFF))
@@ -54,12 +94,23 @@ class SensorService(object):
             b = rgb888 & 0xFF
             return r, g, b       
 
+    def get_lux_and_cct(self):
+        """由最近一次CRGB读数换算, 不再访问I2C; 太暗无法计算色温时色温为0"""
+        lux = max(self.tcs34725.getLux(), 0)
+        try:
+            cct = self.tcs34725.getColorTemp()
+        except ZeroDivisionError:
+            cct = 0
+        return round(lux, 1), int(max(cct, 0))
+
     def start_update(self):
         prev_temp1 = None
         prev_humi = None
         prev_press = None
         prev_temp2 = None
         prev_rgb888 = None
+        prev_lux = None
+        prev_cct = None
 
 
         while True:
@@ -83,62 +134,88 @@ class SensorService(object):
             utime.sleep_ms(100)
 
             try:
-                press, temp2 = self.lps22hb.getTempAndPressure()
-                logger.debug("press: {:0.2f}, temp2: {:0.2f}".format(press, temp2))
+                value = self.read_press_and_temp2()
+                if value is not None:
+                    press, temp2 = value
+                    logger.debug("press: {:0.2f}, temp2: {:0.2f}".format(press, temp2))
 
-                if prev_temp2 is None or abs(prev_temp2 - temp2) > 1:
-                    data.update({5: round(temp2, 2)})
-                    prev_temp2 = temp2
+                    if prev_temp2 is None or abs(prev_temp2 - temp2) > 1:
+                        data.update({5: round(temp2, 2)})
+                        prev_temp2 = temp2
 
-                if prev_press is None or abs(prev_press - press) > 1:
-                    data.update({6: round(press, 2)})
-                    prev_press = press
+                    if prev_press is None or abs(prev_press - press) > 1:
+                        data.update({6: round(press, 2)})
+                        prev_press = press
 
             except Exception as e:
                 logger.error("getTempAndPressure error:{}".format(e))
 
             utime.sleep_ms(100)
 
-            try:
-                rgb888 = self.tcs34725.getRGBValue()
-                logger.debug("R: {}, G: {}, B: {}".format((rgb888 >> 16) & 0xFF, (rgb888 >> 8) & 0xFF, rgb888 & 0xFF))
-
-                r = (rgb888 >> 16) & 0xFF
-                g = (rgb888 >> 8) & 0xFF
-                b = rgb888 & 0xFF
-
-                if prev_rgb888 is None:
-                    data.update({7: {1: r, 2: g, 3: b}})
-                    prev_rgb888 = rgb888
-                else:
-                    prev_r = (prev_rgb888 >> 16) & 0xFF
-                    dr = abs(r - prev_r)
-                    
-                    prev_g = (prev_rgb888 >> 8) & 0xFF
-                    dg = abs(g - prev_g)
-                    
-                    prev_b = prev_rgb888 & 0xFF
-                    db = abs(b - prev_b)
-
-                    # 色差超过 150 即认为颜色有变化
-                    if pow(sum((dr*dr, dg*dg, db*db)), 0.5) >= 150:
+            # 中断模式下只在光照变化(INT触发)或需要重新上报时读取颜色
+            if not self.__light_interrupt or prev_rgb888 is None or self.__light_changed.is_set():
+                try:
+                    rgb888 = self.tcs34725.getRGBValue()
+                    logger.debug("R: {}, G: {}, B: {}".format((rgb888 >> 16) & 0xFF, (rgb888 >> 8) & 0xFF, rgb888 & 0xFF))
+
+                    r = (rgb888 >> 16) & 0xFF
+                    g = (rgb888 >> 8) & 0xFF
+                    b = rgb888 & 0xFF
+
+                    if prev_rgb888 is None:
                         data.update({7: {1: r, 2: g, 3: b}})
                         prev_rgb888 = rgb888
-
-            except Exception as e:
-                logger.error("getRGBValue error:{}".format(e))
+                    else:
+                        prev_r = (prev_rgb888 >> 16) & 0xFF
+                        dr = abs(r - prev_r)
+                        
+                        prev_g = (prev_rgb888 >> 8) & 0xFF
+                        dg = abs(g - prev_g)
+                        
+                        prev_b = prev_rgb888 & 0xFF
+                        db = abs(b - prev_b)
+
+                        # 色差超过 150 即认为颜色有变化
+                        if pow(sum((dr*dr, dg*dg, db*db)), 0.5) >= 150:
+                            data.update({7: {1: r, 2: g, 3: b}})
+                            prev_rgb888 = rgb888
+
+                    lux, cct = self.get_lux_and_cct()
+                    logger.debug("lux: {}, cct: {}".format(lux, cct))
+
+                    if prev_lux is None or abs(prev_lux - lux) > max(prev_lux * self.__lux_deadband, 1):
+                        data.update({TSL_ID_LUX: lux})
+                        prev_lux = lux
+
+                    if cct and (prev_cct is None or abs(prev_cct - cct) > self.__cct_deadband):
+                        data.update({TSL_ID_CCT: cct})
+                        prev_cct = cct
+
+                    if self.__light_interrupt:
+                        # 读数成功后才清除事件, 以本次clear值为中心重新设置门限
+                        self.__light_changed.clear()
+                        self.tcs34725.armInterrupt(self.tcs34725.expectedClear(), self.__light_ratio, self.__light_persistence)
+
+                except Exception as e:
+                    logger.error("getRGBValue error:{}".format(e))
+                    if self.__light_interrupt:
+                        # 保留事件下一轮重读; 并释放INT引脚, 否则之后不会再有下降沿
+                        self.__light_changed.set()
+                        try:
+                            self.tcs34725.clearInterruptFlag()
+                        except Exception as e:
+                            logger.error("clearInterruptFlag error:{}".format(e))
 
             if data:
-                with CurrentApp().qth_client:
-                    for _ in range(3):
-                        if CurrentApp().qth_client.sendTsl(1, data):
-                            break
-                        utime.sleep(1)
-                    else:
-                        prev_temp1 = None
-                        prev_humi = None
-                        prev_press = None
-                        prev_temp2 = None
-                        prev_rgb888 = None
+                qth_client = CurrentApp().qth_client
+                if not qth_client.call(qth_client.sendTsl, 1, data):
+                    prev_temp1 = None
+                    prev_humi = None
+                    prev_press = None
+                    prev_temp2 = None
+                    prev_rgb888 = None
+                    prev_lux = None
+                    prev_cct = None
+                    qth_client.retry.wait()
 
             utime.sleep(1)
@@ -0,0 +1,200 @@
+"""
+Great-circle helpers for the GNSS pipeline.
+
+`gps_distance` is the exact haversine distance. `DistanceEngine` measures from
+a fixed reference point and, for the short hops the movement threshold cares
+about, uses an equirectangular projection with the reference latitude's cosine
+cached, so a fix costs a few multiplications instead of four trig calls.
+"""
+
+
+try:
+    from math import sin, asin, cos, radians, fabs, sqrt, pi
+except:
+    from cmath import sin as csin, cos as ccos, pi
+
+    def radians(x):
+        return x * pi / 180.0
+    
+    def fabs(x):
+        return x if x > 0 else -x
+
+    def sin(x):
+        return csin(x).real
+    
+    def cos(x):
+        return ccos(x).real
+    
+    def asin(x):
+        low, high = -1, 1
+        while abs(high - low) > 1e-10:  # 精度控制
+            mid = (low + high) / 2.0
+            if sin(mid) < x:
+                low = mid
+            else:
+                high = mid
+        return (low + high) / 2.0
+
+
+EARTH_RADIUS = 6371  # 地球平均半径大约6371km
+KM_PER_DEGREE = EARTH_RADIUS * pi / 180.0
+M_PER_DEGREE = KM_PER_DEGREE * 1000
+EQUIRECT_MAX_DISTANCE = 5  # km, 超过该距离时改用haversine
+
+
+def hav(theta):
+    s = sin(theta / 2)
+    return s * s
+
+
+def gps_distance(lat0, lng0, lat1, lng1):
+    # 用haversine公式计算球面两点间的距离
+    # 经纬度转换成弧度
+    lat0 = radians(lat0)
+    lat1 = radians(lat1)
+    lng0 = radians(lng0)
+    lng1 = radians(lng1)
+    dlng = fabs(lng0 - lng1)
+    dlat = fabs(lat0 - lat1)
+    h = hav(dlat) + cos(lat0) * cos(lat1) * hav(dlng)
+    distance = 2 * EARTH_RADIUS * asin(pow(h, 0.5))  # km
+    # distance = int(distance * 1000)  # m
+    return distance
+
+
+class DistanceEngine(object):
+
+    def __init__(self, max_equirect_distance=EQUIRECT_MAX_DISTANCE):
+        self.__max_equirect_sq = max_equirect_distance * max_equirect_distance
+        self.__lat = None
+        self.__lng = None
+        self.__lng_scale = 0.0
+
+    @property
+    def reference(self):
+        if self.__lat is None:
+            return None
+        return self.__lat, self.__lng
+
+    def setReference(self, lat, lng):
+        self.__lat = lat
+        self.__lng = lng
+        self.__lng_scale = KM_PER_DEGREE * cos(radians(lat))
+
+    def clearReference(self):
+        self.__lat = None
+        self.__lng = None
+
+    def __squared(self, lat, lng):
+        dlng = lng - self.__lng
+        if dlng > 180:
+            dlng -= 360
+        elif dlng < -180:
+            dlng += 360
+        dx = dlng * self.__lng_scale
+        dy = (lat - self.__lat) * KM_PER_DEGREE
+        return dx * dx + dy * dy
+
+    def distance(self, lat, lng):
+        """distance in km from the reference point"""
+        squared = self.__squared(lat, lng)
+        if squared > self.__max_equirect_sq:
+            return gps_distance(self.__lat, self.__lng, lat, lng)
+        return pow(squared, 0.5)
+
+    def exceeds(self, lat, lng, threshold):
+        """whether (lat, lng) is at least `threshold` km away, without a sqrt"""
+        if threshold * threshold > self.__max_equirect_sq:
+            return self.distance(lat, lng) >= threshold
+        return self.__squared(lat, lng) >= threshold * threshold
+
+
+if __name__ == '__main__':
+    # Accuracy and speed against gps_distance on the host, for both the math
+    # build and the cmath/bisection fallback used by firmware without math:
+    #   python3 code/libs/geo.py
+    import random
+    import sys
+    import time
+
+    def load_fallback():
+        # 屏蔽 math 重新执行本模块, 走 cmath 分支
+        module = type(sys)('geo_fallback')
+        saved = sys.modules.get('math')
+        sys.modules['math'] = None
+        try:
+            with open(__file__) as f:
+                exec(f.read(), vars(module))
+        finally:
+            sys.modules['math'] = saved
+        assert 'csin' in vars(module), 'math was not blocked'
+        return module
+
+    def make_samples(count, max_span):
+        samples = []
+        for _ in range(count):
+            lat0 = random.uniform(-80, 80)
+            lng0 = random.uniform(-180, 180)
+            bearing = random.uniform(0, 2 * pi)
+            span = random.uniform(0.001, max_span) / KM_PER_DEGREE
+            samples.append((lat0, lng0, lat0 + span * cos(bearing), lng0 + span * sin(bearing) / cos(radians(lat0))))
+        return samples
+
+    def worst_error(engine, samples):
+        worst_abs = worst_rel = 0.0
+        for lat0, lng0, lat1, lng1 in samples:
+            exact = gps_distance(lat0, lng0, lat1, lng1)
+            engine.setReference(lat0, lng0)
+            error = abs(engine.distance(lat1, lng1) - exact)
+            worst_abs = max(worst_abs, error)
+            worst_rel = max(worst_rel, error / exact)
+        return worst_abs, worst_rel
+
+    def time_haversine(module, samples):
+        begin = time.perf_counter()
+        for lat0, lng0, lat1, lng1 in samples:
+            module.gps_distance(lat0, lng0, lat1, lng1) >= 0.05
+        return (time.perf_counter() - begin) / len(samples) * 1e6
+
+    def time_engine(module, samples):
+        engine = module.DistanceEngine()
+        engine.setReference(*samples[0][:2])
+        begin = time.perf_counter()
+        for _, _, lat1, lng1 in samples:
+            engine.exceeds(lat1, lng1, 0.05)
+        return (time.perf_counter() - begin) / len(samples) * 1e6
+
+    random.seed(20)
+    samples = make_samples(20000, EQUIRECT_MAX_DISTANCE)
+    near = make_samples(20000, 0.1)
+    engine = DistanceEngine()
+
+    # 近似误差: 5km内相对误差 < 0.1%, 100m内 < 5mm
+    worst_abs, worst_rel = worst_error(engine, samples)
+    print('max error below {} km: {:.3f} m ({:.4%})'.format(EQUIRECT_MAX_DISTANCE, worst_abs * 1000, worst_rel))
+    assert worst_rel < 1e-3, worst_rel
+    near_abs, _ = worst_error(engine, near)
+    print('max error below 100 m: {:.4f} mm'.format(near_abs * 1e6))
+    assert near_abs < 5e-6, near_abs
+
+    # 50m判定与haversine一致(门限附近1mm内不计)
+    for lat0, lng0, lat1, lng1 in near:
+        exact = gps_distance(lat0, lng0, lat1, lng1)
+        if abs(exact - 0.05) > 1e-6:
+            engine.setReference(lat0, lng0)
+            assert engine.exceeds(lat1, lng1, 0.05) == (exact >= 0.05), (lat0, lng0, lat1, lng1)
+
+    # cmath/二分asin 回退实现与 math 版本一致
+    fallback = load_fallback()
+    fallback_samples = samples[:2000]
+    for lat0, lng0, lat1, lng1 in fallback_samples:
+        error = abs(fallback.gps_distance(lat0, lng0, lat1, lng1) - gps_distance(lat0, lng0, lat1, lng1))
+        assert error < 1e-5, error  # 1cm
+    fallback_engine = fallback.DistanceEngine()
+    fallback_abs, fallback_rel = worst_error(fallback_engine, fallback_samples)
+    assert fallback_rel < 1e-3, fallback_rel
+
+    print('math  : gps_distance {:7.2f} us/fix, DistanceEngine.exceeds {:5.2f} us/fix'.format(
+        time_haversine(sys.modules[__name__], samples), time_engine(sys.modules[__name__], samples)))
+    print('cmath : gps_distance {:7.2f} us/fix, DistanceEngine.exceeds {:5.2f} us/fix'.format(
+        time_haversine(fallback, fallback_samples), time_engine(fallback, fallback_samples)))
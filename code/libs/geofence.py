@@ -0,0 +1,139 @@
+"""
+Geofences indexed by a uniform lat/lng grid.
+
+Each fence is registered in every grid cell its bounding box touches, so a fix
+only tests the handful of fences in its own cell instead of every polygon the
+device knows about. `GeofenceEngine.update` returns enter/exit transitions.
+
+Fences are loaded from config, e.g.:
+
+    "GEOFENCES": [
+        {"id": 1, "circle": [31.2304, 121.4737, 200]},
+        {"id": 2, "polygon": [[31.20, 121.40], [31.21, 121.40], [31.21, 121.42]]}
+    ]
+
+circle is [lat, lng, radius in metres], polygon is a list of [lat, lng].
+Malformed entries are skipped and returned by `load` so the caller can log
+them; one bad fence does not stop the others from loading.
+"""
+
+from .geo import M_PER_DEGREE, cos, radians
+
+
+class CircleFence(object):
+
+    def __init__(self, fence_id, lat, lng, radius):
+        self.id = fence_id
+        self.lat = lat
+        self.lng = lng
+        self.radius = radius
+        self.__lng_scale = M_PER_DEGREE * cos(radians(lat))
+        dlat = radius / M_PER_DEGREE
+        dlng = radius / self.__lng_scale
+        self.bbox = (lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+
+    def contains(self, lat, lng):
+        dx = (lng - self.lng) * self.__lng_scale
+        dy = (lat - self.lat) * M_PER_DEGREE
+        return dx * dx + dy * dy <= self.radius * self.radius
+
+
+class PolygonFence(object):
+
+    def __init__(self, fence_id, points):
+        if len(points) < 3:
+            raise ValueError('polygon fence {} needs at least 3 points'.format(fence_id))
+        self.id = fence_id
+        self.lats = [float(point[0]) for point in points]
+        self.lngs = [float(point[1]) for point in points]
+        self.bbox = (min(self.lats), min(self.lngs), max(self.lats), max(self.lngs))
+
+    def contains(self, lat, lng):
+        bbox = self.bbox
+        if lat < bbox[0] or lat > bbox[2] or lng < bbox[1] or lng > bbox[3]:
+            return False
+        # 射线法
+        lats = self.lats
+        lngs = self.lngs
+        inside = False
+        j = len(lats) - 1
+        for i in range(len(lats)):
+            if (lats[i] > lat) != (lats[j] > lat):
+                cross = lngs[i] + (lat - lats[i]) * (lngs[j] - lngs[i]) / (lats[j] - lats[i])
+                if lng < cross:
+                    inside = not inside
+            j = i
+        return inside
+
+
+class GeofenceEngine(object):
+
+    CELL_SIZE = 0.01  # 度, 约1.1km
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.__grid = {}
+        self.__inside = set()
+        self.count = 0
+
+    @property
+    def cell_size(self):
+        return self.__cell_size
+
+    @cell_size.setter
+    def cell_size(self, value):
+        """Set before `load`; fences already added stay in the old grid."""
+        if not value > 0:
+            raise ValueError('geofence cell size must be positive: {}'.format(value))
+        self.__cell_size = value
+        # 一行的格子数大于经度方向的列数, 行列合成的key不会冲突
+        self.__cols = int(360 // value) + 2
+
+    def __cell(self, value):
+        return int(value // self.__cell_size)
+
+    def __key(self, row, col):
+        # 行列合成一个int, 避免每次查找构造tuple
+        return row * self.__cols + col
+
+    def add(self, fence):
+        bbox = fence.bbox
+        for row in range(self.__cell(bbox[0]), self.__cell(bbox[2]) + 1):
+            for col in range(self.__cell(bbox[1]), self.__cell(bbox[3]) + 1):
+                self.__grid.setdefault(self.__key(row, col), []).append(fence)
+        self.count += 1
+
+    @staticmethod
+    def __fence(config):
+        if 'circle' in config:
+            lat, lng, radius = config['circle']
+            return CircleFence(config['id'], float(lat), float(lng), float(radius))
+        if 'polygon' in config:
+            return PolygonFence(config['id'], config['polygon'])
+        raise ValueError('unknown geofence config')
+
+    def load(self, configs):
+        """Replace all fences; return [(config, error), ...] for the entries skipped."""
+        self.__grid = {}
+        self.__inside = set()
+        self.count = 0
+        skipped = []
+        for config in configs:
+            try:
+                self.add(self.__fence(config))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                skipped.append((config, e))
+        return skipped
+
+    def update(self, lat, lng):
+        """Return [(fence_id, entered), ...] for fences whose state changed."""
+        inside = set()
+        for fence in self.__grid.get(self.__key(self.__cell(lat), self.__cell(lng)), ()):
+            if fence.contains(lat, lng):
+                inside.add(fence.id)
+        if inside == self.__inside:
+            return []
+        events = [(fence_id, True) for fence_id in inside - self.__inside]
+        events.extend((fence_id, False) for fence_id in self.__inside - inside)
+        self.__inside = inside
+        return events
@@ -25,6 +25,12 @@ class I2CIOWrapper(object):
             raise self.I2CReadError("slave 0x{:X} read failed".format(self.__slaveaddr))
         return data
 
+    def readInto(self, addr, buf, delay=0):
+        """Read len(buf) bytes into a caller owned buffer, no allocation."""
+        if self.__i2c.read(self.__slaveaddr, addr, len(addr), buf, len(buf), delay) != 0:
+            raise self.I2CReadError("slave 0x{:X} read failed".format(self.__slaveaddr))
+        return buf
+
     def write(self, addr, data):
         if not isinstance(data, (bytearray, bytes)):
             raise TypeError('`data` should be bytearray or bytes')
@@ -0,0 +1,145 @@
+"""
+Constant-velocity Kalman filter for GNSS positions.
+
+Positions are projected onto a local east/north plane (metres) around the
+first fix and each axis runs an independent position/velocity filter. All
+state lives in one preallocated list that is updated in place, so a fix does
+not allocate anything beyond the floats MicroPython boxes anyway.
+"""
+
+from .geo import M_PER_DEGREE, cos, radians
+
+# state 下标: 每个轴依次为 位置, 速度, P00, P01, P11
+_X, _V, _P00, _P01, _P11 = range(5)
+_EAST = 0
+_NORTH = 5
+
+
+class PositionFilter(object):
+
+    ACCEL_NOISE = 0.5  # m^2/s^3, 车辆加速度的过程噪声谱密度
+    MAX_GAP = 120  # s, 两次定位间隔超过该值时速度估计失效, 按静止处理
+    GAP_DRIFT = 0.02  # m/s, 长间隔期间静止设备位置的随机游走速率
+    STILL_SPEED = 1.0  # m/s, 长间隔后的定位速度达到该值时重新初始化
+    MAX_JUMP = 2000  # m, 新息过大(如冷启动后首个定位)则重新初始化
+    RECENTER_DISTANCE = 20000  # m, 离投影原点过远时平移原点, 控制投影误差
+
+    def __init__(self, accel_noise=ACCEL_NOISE):
+        self.accel_noise = accel_noise
+        self.__state = [0.0] * 10
+        self.__origin_lat = None
+        self.__origin_lng = 0.0
+        self.__lng_scale = 0.0
+
+    @property
+    def ready(self):
+        return self.__origin_lat is not None
+
+    @property
+    def lat(self):
+        return self.__origin_lat + self.__state[_NORTH + _X] / M_PER_DEGREE
+
+    @property
+    def lng(self):
+        return self.__origin_lng + self.__state[_EAST + _X] / self.__lng_scale
+
+    @property
+    def speed(self):
+        """smoothed ground speed in m/s"""
+        state = self.__state
+        return pow(state[_EAST + _V] ** 2 + state[_NORTH + _V] ** 2, 0.5)
+
+    def reset(self):
+        self.__origin_lat = None
+
+    def __init_axis(self, offset, position, variance):
+        state = self.__state
+        state[offset + _X] = position
+        state[offset + _V] = 0.0
+        state[offset + _P00] = variance
+        state[offset + _P01] = 0.0
+        state[offset + _P11] = 100.0  # (10m/s)^2, 初始速度未知
+
+    def __start(self, lat, lng, variance):
+        self.__origin_lat = lat
+        self.__origin_lng = lng
+        self.__lng_scale = M_PER_DEGREE * cos(radians(lat))
+        self.__init_axis(_EAST, 0.0, variance)
+        self.__init_axis(_NORTH, 0.0, variance)
+
+    def __recenter(self):
+        state = self.__state
+        lat = self.lat
+        lng = self.lng
+        self.__origin_lat = lat
+        self.__origin_lng = lng
+        self.__lng_scale = M_PER_DEGREE * cos(radians(lat))
+        state[_EAST + _X] = 0.0
+        state[_NORTH + _X] = 0.0
+
+    def __coast(self, offset, dt):
+        # 长间隔(静止时GNSS退避读取)后: 速度归零, 位置方差只按静止漂移增长,
+        # 而不是匀速模型下 dt^3 增长, 否则新定位会完全覆盖滤波结果
+        state = self.__state
+        drift = self.GAP_DRIFT * dt
+        state[offset + _V] = 0.0
+        state[offset + _P00] += drift * drift
+        state[offset + _P01] = 0.0
+        state[offset + _P11] = 100.0
+
+    def __predict(self, offset, dt):
+        state = self.__state
+        q = self.accel_noise
+        p01 = state[offset + _P01]
+        p11 = state[offset + _P11]
+        state[offset + _X] += state[offset + _V] * dt
+        state[offset + _P00] += dt * (2 * p01 + dt * p11) + q * dt * dt * dt / 3
+        state[offset + _P01] = p01 + dt * p11 + q * dt * dt / 2
+        state[offset + _P11] = p11 + q * dt
+
+    def __correct(self, offset, z, variance):
+        state = self.__state
+        p00 = state[offset + _P00]
+        p01 = state[offset + _P01]
+        s = p00 + variance
+        k0 = p00 / s
+        k1 = p01 / s
+        innovation = z - state[offset + _X]
+        state[offset + _X] += k0 * innovation
+        state[offset + _V] += k1 * innovation
+        state[offset + _P00] = (1 - k0) * p00
+        state[offset + _P01] = (1 - k0) * p01
+        state[offset + _P11] -= k1 * p01
+
+    def update(self, lat, lng, accuracy, dt, speed=None):
+        """Feed one fix.
+
+        :param accuracy: estimated horizontal error in metres
+        :param dt: seconds since the previous fix
+        :param speed: ground speed of this fix in m/s, if known. After a gap
+            longer than MAX_GAP the filter restarts only if this says the
+            device is moving; otherwise the fix is smoothed against the
+            parked position, and MAX_JUMP still catches large moves.
+        """
+        variance = accuracy * accuracy
+        gap = dt > self.MAX_GAP
+        if self.__origin_lat is None or (gap and speed is not None and speed >= self.STILL_SPEED):
+            self.__start(lat, lng, variance)
+            return
+
+        east = (lng - self.__origin_lng) * self.__lng_scale
+        north = (lat - self.__origin_lat) * M_PER_DEGREE
+        state = self.__state
+        if gap:
+            self.__coast(_EAST, dt)
+            self.__coast(_NORTH, dt)
+        elif dt > 0:
+            self.__predict(_EAST, dt)
+            self.__predict(_NORTH, dt)
+        if abs(east - state[_EAST + _X]) > self.MAX_JUMP or abs(north - state[_NORTH + _X]) > self.MAX_JUMP:
+            self.__start(lat, lng, variance)
+            return
+        self.__correct(_EAST, east, variance)
+        self.__correct(_NORTH, north, variance)
+        if abs(state[_EAST + _X]) > self.RECENTER_DISTANCE or abs(state[_NORTH + _X]) > self.RECENTER_DISTANCE:
+            self.__recenter()
@@ -0,0 +1,79 @@
+"""
+Incremental odometer and trip accumulator.
+
+Distance is summed from smoothed fixes in STEP sized segments so that the
+residual jitter of a parked device does not add up. Totals persist in a json
+file through `Storage`; writes are debounced (SAVE_DISTANCE and SAVE_INTERVAL
+must both have passed) except at the end of a trip, to spare the flash.
+"""
+
+from .common import Storage
+from .geo import DistanceEngine
+
+
+class Odometer(object):
+
+    STEP = 0.02  # km, 离上一个计数点超过该距离才累加
+    SAVE_DISTANCE = 1  # km
+    SAVE_INTERVAL = 600  # s
+    TRIP_IDLE = 300  # s, 静止超过该时间视为行程结束
+
+    def __init__(self, path='/usr/odometer.json'):
+        self.__path = path
+        self.__storage = None
+        self.__engine = DistanceEngine()
+        self.total = 0.0  # km
+        self.trip = 0.0  # km, 当前(或上一次)行程里程
+        self.__saved_total = 0.0
+        self.__saved_time = 0
+        self.__moved_time = None  # 行程中最后一次移动的时间, None表示不在行程中
+
+    def load(self):
+        self.__storage = Storage()
+        self.__storage.init(self.__path)
+        self.total = self.__storage.get('total', 0.0)
+        self.trip = self.__storage.get('trip', 0.0)
+        self.__saved_total = self.total
+
+    def save(self, now):
+        if self.__storage is None:
+            return
+        with self.__storage:
+            self.__storage['total'] = self.total
+            self.__storage['trip'] = self.trip
+            self.__storage.save()
+        self.__saved_total = self.total
+        self.__saved_time = now
+
+    @property
+    def moving(self):
+        return self.__moved_time is not None
+
+    def update(self, lat, lng, now):
+        """Feed one smoothed fix, `now` in seconds.
+
+        :return: True if the totals changed or a trip just ended
+        """
+        engine = self.__engine
+        if engine.reference is None:
+            engine.setReference(lat, lng)
+            return False
+
+        if engine.exceeds(lat, lng, self.STEP):
+            if self.__moved_time is None:
+                self.trip = 0.0  # 新行程
+            distance = engine.distance(lat, lng)
+            engine.setReference(lat, lng)
+            self.total += distance
+            self.trip += distance
+            self.__moved_time = now
+            if self.total - self.__saved_total >= self.SAVE_DISTANCE and now - self.__saved_time >= self.SAVE_INTERVAL:
+                self.save(now)
+            return True
+
+        if self.__moved_time is not None and now - self.__moved_time >= self.TRIP_IDLE:
+            self.__moved_time = None
+            if self.total != self.__saved_total:
+                self.save(now)
+            return True
+        return False
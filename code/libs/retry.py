@@ -0,0 +1,109 @@
+"""
+Exponential backoff shared by the uplink producers.
+
+One RetryPolicy instance lives on the Qth client. Every producer sends through
+`run`, so a failure seen by one of them pushes the next attempt of all of them
+back: 1, 2, 4 ... seconds up to `max_interval`, each scaled by a random jitter
+so that the threads do not retry in lock step. The Qth client feeds the link
+state into `linkDown` / `linkUp`: while the link is down `run` does not call
+the producer at all and keeps backing off, and `linkUp` clears the backoff and
+wakes every producer blocked in `wait`, so uploads resume as soon as the link
+returns.
+"""
+
+import utime
+try:
+    import urandom as random
+except ImportError:
+    import random
+from .threading import Condition
+
+
+class RetryPolicy(object):
+
+    BASE = 1  # s
+    MAX_INTERVAL = 300  # s
+    JITTER = 0.25  # 间隔在 [1 - JITTER, 1 + JITTER] 倍之间随机
+    ATTEMPTS = 3  # 每次发送连续尝试的次数
+
+    def __init__(self, base=BASE, max_interval=MAX_INTERVAL, jitter=JITTER, attempts=ATTEMPTS):
+        self.base = base
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.attempts = attempts
+        self.failures = 0
+        self.online = True
+        self.__next = 0  # 下一次允许发送的时间(utime.time())
+        self.__generation = 0  # 每次恢复加1, 唤醒wait中的线程
+        self.__cond = Condition()
+
+    def delay(self):
+        """当前失败次数对应的退避间隔(秒), 含抖动"""
+        if not self.failures:
+            return 0
+        interval = self.base * (1 << min(self.failures - 1, 16))
+        interval *= 1 - self.jitter + 2 * self.jitter * random.random()
+        return min(interval, self.max_interval)
+
+    def ready(self):
+        return utime.time() >= self.__next
+
+    def remaining(self):
+        return max(self.__next - utime.time(), 0)
+
+    def __resume(self):
+        with self.__cond:
+            self.failures = 0
+            self.__next = 0
+            self.__generation += 1
+            self.__cond.notify_all()
+
+    def success(self):
+        if self.failures:
+            self.__resume()
+
+    def failure(self):
+        with self.__cond:
+            self.failures += 1
+            self.__next = utime.time() + self.delay()
+
+    def linkUp(self):
+        self.online = True
+        self.__resume()
+
+    def linkDown(self):
+        self.online = False
+        with self.__cond:
+            if not self.failures:
+                self.failures = 1
+                self.__next = utime.time() + self.delay()
+
+    def run(self, func, *args):
+        """调用 func(*args) 直到返回真值, 最多 attempts 次.
+
+        退避期间不调用, 直接返回False; 链路断开时也不调用, 继续退避;
+        成功后退避清零.
+        """
+        if not self.ready():
+            return False
+        if not self.online:
+            self.failure()
+            return False
+        for _ in range(self.attempts):
+            result = func(*args)
+            if result:
+                self.success()
+                return result
+        self.failure()
+        return False
+
+    def wait(self, timeout=None):
+        """阻塞到退避结束(最多 timeout 秒), 链路恢复时提前返回"""
+        remaining = self.remaining()
+        if timeout is not None:
+            remaining = min(remaining, timeout)
+        if remaining <= 0:
+            return
+        with self.__cond:
+            generation = self.__generation
+            self.__cond.wait_for(lambda: self.__generation != generation, timeout=remaining)
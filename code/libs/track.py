@@ -0,0 +1,101 @@
+"""
+Online track simplification for batched location uploads.
+
+TrackBuffer keeps the points needed to redraw the route within `tolerance`
+metres (an opening-window variant of Douglas-Peucker that works one fix at a
+time) and tells the caller when a batch should be flushed: enough points, the
+oldest point is too old, or the course turned sharply.
+"""
+
+from .geo import M_PER_DEGREE, cos, radians
+
+
+class TrackBuffer(object):
+
+    MAX_WINDOW = 32  # 候选点窗口上限, 限制每个定位的计算量
+
+    def __init__(self, tolerance=10, max_points=30, max_age=600, turn_angle=60):
+        self.tolerance = tolerance  # m
+        self.max_points = max_points
+        self.max_age = max_age  # s
+        self.turn_angle = turn_angle  # 度
+        self.__points = []  # 待上报的关键点 (timestamp, lat, lng, course)
+        self.__window = []  # 上一个关键点之后的候选点
+        self.__anchor = None
+        self.__lng_scale = 0.0
+        self.__turned = False
+
+    def __len__(self):
+        return len(self.__points)
+
+    def __xy(self, point):
+        # 以anchor为原点的局部平面坐标(m)
+        anchor = self.__anchor
+        return (point[2] - anchor[2]) * self.__lng_scale, (point[1] - anchor[1]) * M_PER_DEGREE
+
+    def __commit(self, point):
+        self.__points.append(point)
+        self.__anchor = point
+        self.__lng_scale = M_PER_DEGREE * cos(radians(point[1]))
+
+    def __deviates(self, point):
+        # 窗口内的候选点是否有偏离 anchor->point 线段超过tolerance的
+        bx, by = self.__xy(point)
+        length = bx * bx + by * by
+        limit = self.tolerance * self.tolerance
+        for candidate in self.__window:
+            px, py = self.__xy(candidate)
+            if length > 0:
+                t = (px * bx + py * by) / length
+                t = 0 if t < 0 else (1 if t > 1 else t)
+                px -= t * bx
+                py -= t * by
+            if px * px + py * py > limit:
+                return True
+        return False
+
+    def __turning(self, course):
+        anchor_course = self.__anchor[3]
+        if course is None or anchor_course is None:
+            return False
+        delta = abs(course - anchor_course) % 360
+        return min(delta, 360 - delta) >= self.turn_angle
+
+    def append(self, timestamp, lat, lng, course=None):
+        point = (timestamp, lat, lng, course)
+        if self.__anchor is None:
+            self.__commit(point)
+            return
+        if self.__turning(course):
+            if self.__window:
+                self.__commit(self.__window[-1])
+            self.__commit(point)
+            self.__window = []
+            self.__turned = True
+            return
+        if len(self.__window) >= self.MAX_WINDOW or self.__deviates(point):
+            self.__commit(self.__window[-1])
+            self.__window = []
+        self.__window.append(point)
+
+    def ready(self, now):
+        if self.__turned or len(self.__points) >= self.max_points:
+            return True
+        oldest = self.__points or self.__window
+        return bool(oldest) and now - oldest[0][0] >= self.max_age
+
+    def flush(self):
+        """Return the points to upload, ending with the latest fix."""
+        if self.__window:
+            self.__commit(self.__window[-1])
+            self.__window = []
+        points = self.__points
+        self.__points = []
+        self.__turned = False
+        return points
+
+    def restore(self, points):
+        """Put back a batch that failed to upload, dropping the oldest points beyond 4 batches."""
+        points.extend(self.__points)
+        self.__points = points[-self.max_points * 4:]
+
@@ -0,0 +1,90 @@
+"""
+Compact binary encoding for batched location tracks.
+
+Layout (integers are LEB128 varints, point fields are zigzag encoded):
+
+    version(1 byte) | digits(1 byte) | count
+    first point:  timestamp | lat | lng
+    next points:  dt        | dlat | dlng
+
+`timestamp` is Unix seconds, lat/lng are fixed-point with `digits` decimals
+(5 digits is about 1.1 m). Consecutive fixes of a moving vehicle differ by a
+few hundred units, so a point usually costs 4-6 bytes instead of ~70 for the
+NMEA sentence. The decoder has no device dependencies and runs on the host:
+
+    python3 code/libs/trackcodec.py <hex payload>
+"""
+
+
+TRACK_VERSION = 1
+TRACK_DIGITS = 5
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _put_varint(buf, value):
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _get_varint(buf, index):
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[index]
+        index += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, index
+        shift += 7
+
+
+def encode_track(points, digits=TRACK_DIGITS):
+    """points: [(timestamp, lat, lng, ...), ...] -> bytes"""
+    scale = 10 ** digits
+    buf = bytearray((TRACK_VERSION, digits))
+    _put_varint(buf, len(points))
+    prev_time = prev_lat = prev_lng = 0
+    for point in points:
+        timestamp = int(point[0])
+        lat = int(round(point[1] * scale))
+        lng = int(round(point[2] * scale))
+        _put_varint(buf, _zigzag(timestamp - prev_time))
+        _put_varint(buf, _zigzag(lat - prev_lat))
+        _put_varint(buf, _zigzag(lng - prev_lng))
+        prev_time, prev_lat, prev_lng = timestamp, lat, lng
+    return bytes(buf)
+
+
+def decode_track(payload):
+    """bytes -> [(timestamp, lat, lng), ...]"""
+    if not payload or payload[0] != TRACK_VERSION:
+        raise ValueError('unsupported track payload version')
+    scale = 10 ** payload[1]
+    count, index = _get_varint(payload, 2)
+    points = []
+    timestamp = lat = lng = 0
+    for _ in range(count):
+        value, index = _get_varint(payload, index)
+        timestamp += _unzigzag(value)
+        value, index = _get_varint(payload, index)
+        lat += _unzigzag(value)
+        value, index = _get_varint(payload, index)
+        lng += _unzigzag(value)
+        points.append((timestamp, lat / scale, lng / scale))
+    return points
+
+
+if __name__ == '__main__':
+    import sys
+
+    for point in decode_track(bytes.fromhex(sys.argv[1])):
+        print('{},{:.6f},{:.6f}'.format(*point))
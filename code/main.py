@@ -6,8 +6,9 @@ try:
     from libs import Application
     from extensions import (
     qth_client,
-    # gnss_service,
+    gnss_service,
     lbs_service,
+    location_service,
     sensor_service,
 )
 except ImportError:
@@ -15,8 +16,9 @@ except ImportError:
     from usr.libs import Application
     from usr.extensions import (
     qth_client,
-    # gnss_service,
+    gnss_service,
     lbs_service,
+    location_service,
     sensor_service,
     )
 
@@ -30,8 +32,9 @@ def create_app(name="SimpliKit", version="1.0.0", config_path="/usr/config.json"
     _app.config.init(config_path)
 
     qth_client.init_app(_app)
-    # gnss_service.init_app(_app)
+    gnss_service.init_app(_app)
     lbs_service.init_app(_app)
+    location_service.init_app(_app)  # 需在定位源之后注册, 接管它们的上报线程
     sensor_service.init_app(_app)
 
     return _app
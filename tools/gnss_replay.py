@@ -0,0 +1,278 @@
+"""
+Replay recorded NMEA logs through GnssService on a Linux host.
+
+ReplayGnss stands in for the `quecgnss` firmware module: it serves the log
+through the same read(size) contract, at most `chunk` bytes per call, with
+sentences "arriving" at the rate of their own UTC timestamps. The clock is
+virtual by default (utime.sleep returns immediately and advances it), or the
+wall clock with --realtime. FakeQthClient records every upload instead of
+publishing it. The remaining QuecPython-only modules are replaced by minimal
+host stand-ins before the service is imported.
+
+    python3 tools/gnss_replay.py capture.nmea [--chunk 512] [--realtime]
+
+Prints parse throughput, CPU per read and the uploads the run produced.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code')
+
+
+class ReplayFinished(BaseException):
+    """End of the log; not an Exception so the services' error guards let it through."""
+
+
+class Clock(object):
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.__start = time.monotonic()
+        self.__virtual = 0.0
+
+    def now(self):
+        if self.realtime:
+            return time.monotonic() - self.__start
+        return self.__virtual
+
+    def sleep(self, seconds):
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self.__virtual += seconds
+
+
+def _sentence_time(line):
+    # RMC/GGA/GLL 的 hhmmss 字段, 转为当天秒数
+    fields = line.split(b',')
+    kind = fields[0][3:6]
+    index = {b'RMC': 1, b'GGA': 1, b'GLL': 5}.get(kind)
+    if index is None or len(fields) <= index or len(fields[index]) < 6:
+        return None
+    value = fields[index]
+    try:
+        return int(value[0:2]) * 3600 + int(value[2:4]) * 60 + float(value[4:])
+    except ValueError:
+        return None
+
+
+def load_epochs(paths):
+    """Group log lines into (arrival offset in seconds, bytes) epochs."""
+    epochs = []
+    first = last = None
+    day = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                line = line.rstrip(b'\r\n') + b'\r\n'
+                stamp = _sentence_time(line)
+                if stamp is not None:
+                    if first is None:
+                        first = stamp
+                    if last is not None and stamp + day < last - 43200:
+                        day += 86400  # 跨零点
+                    stamp += day
+                    last = stamp
+                offset = 0.0 if last is None else last - first
+                if epochs and epochs[-1][0] == offset:
+                    epochs[-1][1].extend(line)
+                else:
+                    epochs.append((offset, bytearray(line)))
+    return [(offset, bytes(data)) for offset, data in epochs]
+
+
+class ReplayGnss(object):
+    """quecgnss replacement backed by recorded epochs."""
+
+    def __init__(self, epochs, clock, chunk=4096, buffer_size=4096, ttff=1.0):
+        self.epochs = epochs
+        self.clock = clock
+        self.chunk = chunk
+        self.buffer_size = buffer_size  # 接收缓冲区, 读得慢时只保留最新数据
+        self.ttff = ttff  # 重新上电后多久开始输出数据
+        self.enabled = True
+        self.reads = 0
+        self.served = bytearray()
+        self.__index = 0
+        self.__pending = bytearray()
+        self.__on_time = 0.0
+
+    def init(self):
+        return 0
+
+    def get_state(self):
+        return 2 if self.enabled else 0
+
+    def gnssEnable(self, flag):
+        if flag and not self.enabled:
+            self.__on_time = self.clock.now()
+        self.enabled = bool(flag)
+        return 0
+
+    def read(self, size):
+        now = self.clock.now()
+        while self.__index < len(self.epochs) and self.epochs[self.__index][0] <= now:
+            offset, data = self.epochs[self.__index]
+            if self.enabled and offset >= self.__on_time + self.ttff:
+                self.__pending.extend(data)
+            self.__index += 1
+        if self.__index >= len(self.epochs) and not self.__pending:
+            raise ReplayFinished()
+        if len(self.__pending) > self.buffer_size:
+            del self.__pending[:len(self.__pending) - self.buffer_size]
+        count = min(size, self.chunk, len(self.__pending))
+        data = bytes(self.__pending[:count])
+        del self.__pending[:count]
+        self.reads += 1
+        self.served.extend(data)
+        return count, data
+
+
+class FakeQthClient(object):
+    """Records uploads instead of publishing them."""
+
+    def __init__(self):
+        self.uploads = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+    def __record(self, kind, payload):
+        count, size = self.uploads.get(kind, (0, 0))
+        self.uploads[kind] = (count + 1, size + len(payload if isinstance(payload, (bytes, str)) else str(payload)))
+        return True
+
+    def isStatusOk(self):
+        return True
+
+    def call(self, func, *args):
+        return func(*args)
+
+    def sendTsl(self, mode, value):
+        return self.__record('tsl', value)
+
+    def sendLbs(self, lbs_data):
+        return self.__record('lbs', lbs_data)
+
+    def sendGnss(self, nmea_data):
+        return self.__record('gnss', nmea_data)
+
+    def sendTrack(self, payload):
+        return self.__record('track', payload)
+
+
+def install_host_modules(clock, gnss, storage_dir):
+    """Register host stand-ins for the firmware modules GnssService imports."""
+
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    module(
+        'utime',
+        sleep=clock.sleep,
+        sleep_ms=lambda ms: clock.sleep(ms / 1000),
+        ticks_ms=lambda: int(clock.now() * 1000),
+        ticks_diff=lambda a, b: a - b,
+        ticks_add=lambda a, b: a + b,
+        time=lambda: int(clock.now()),
+        localtime=lambda *args: time.gmtime(clock.now())[:8],
+    )
+    module('uio', TextIOWrapper=type(sys.stdout))
+    sys.modules['osTimer'] = type('osTimer', (object,), {})
+    for name in ('net', 'sim', 'modem'):
+        module(name)
+    module('misc', Power=object)
+
+    def path(name):
+        return os.path.join(storage_dir, name.strip('/').replace('/', '_'))
+
+    def touch(name, obj):
+        with open(path(name), 'w') as f:
+            json.dump(obj, f)
+
+    def read_json(name):
+        with open(path(name)) as f:
+            return json.load(f)
+
+    module('ql_fs', path_exists=lambda name: os.path.exists(path(name)), touch=touch, read_json=read_json)
+    sys.modules['quecgnss'] = gnss
+
+    # usr 即设备上的 /usr 目录; 不执行 extensions/__init__, 避免初始化传感器
+    usr = module('usr')
+    usr.__path__ = [CODE_DIR]
+    usr.Qth = module('usr.Qth')
+    extensions = module('usr.extensions')
+    extensions.__path__ = [os.path.join(CODE_DIR, 'extensions')]
+
+
+def replay(paths, chunk=4096, realtime=False, config_path=None):
+    clock = Clock(realtime)
+    gnss = ReplayGnss(load_epochs(paths), clock, chunk=chunk)
+    storage_dir = tempfile.mkdtemp(prefix='gnss_replay_')
+    install_host_modules(clock, gnss, storage_dir)
+
+    from usr.libs import Application
+    from usr.libs.logging import BasicConfig
+    from usr.extensions.gnss_service import GnssService
+
+    BasicConfig.update(debug=False, level='ERROR')
+    app = Application('replay')
+    with open(config_path or os.path.join(CODE_DIR, 'config.json')) as f:
+        app.config.update(json.load(f))
+    qth_client = FakeQthClient()
+    app.register('qth_client', qth_client)
+    service = GnssService(app)
+    service.init()
+
+    cpu = time.process_time()
+    try:
+        service.start_update()
+    except ReplayFinished:
+        pass
+    cpu = time.process_time() - cpu
+
+    served = bytes(gnss.served)
+    return {
+        'duration': clock.now(),
+        'reads': gnss.reads,
+        'cpu': cpu,
+        'sentences': served.count(b'\n'),
+        'fixes': served.count(b'RMC,'),
+        'odometer': service.getOdometer(),
+        'uploads': qth_client.uploads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('logs', nargs='+', help='recorded NMEA log files')
+    parser.add_argument('--chunk', type=int, default=4096, help='max bytes returned by one read()')
+    parser.add_argument('--realtime', action='store_true', help='replay at the recorded rate')
+    parser.add_argument('--config', help='config.json to load (default: code/config.json)')
+    args = parser.parse_args()
+
+    result = replay(args.logs, chunk=args.chunk, realtime=args.realtime, config_path=args.config)
+    cpu = result['cpu'] or 1e-9
+    print('replayed {:.0f} s of data in {} reads, {:.3f} s CPU'.format(result['duration'], result['reads'], cpu))
+    print('parsed {:.0f} sentences/s, {:.0f} fixes/s, {:.1f} us CPU per read'.format(
+        result['sentences'] / cpu, result['fixes'] / cpu, cpu / max(result['reads'], 1) * 1e6))
+    print('odometer {:.2f} km, trip {:.2f} km'.format(*result['odometer']))
+    for kind, (count, size) in sorted(result['uploads'].items()):
+        print('upload {:<6} {:5d} calls {:8d} bytes'.format(kind, count, size))
+
+
+if __name__ == '__main__':
+    main()